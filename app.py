@@ -4,9 +4,10 @@ from config import Config
 from blueprints.replayer import replayer_bp
 from blueprints.statistics import statistics_bp
 from blueprints.uploads import uploads_bp
-from models import init_db
+from models import init_db, migrate_databases
 
 def create_app():
+    Config.ensure_directories()
     app = Flask(__name__)
     app.config.from_object(Config)
     Session(app)
@@ -16,6 +17,9 @@ def create_app():
     app.register_blueprint(statistics_bp, url_prefix='/statistics')
     app.register_blueprint(uploads_bp, url_prefix='/')
 
+    # Upgrade the databases created by older versions before they are used
+    migrate_databases(app.config["DB_DIRECTORY"])
+
     # Custom startup function
 #    with app.app_context():
 #        init_db(current_app.config["DB_PATH"])
@@ -0,0 +1,147 @@
+"""
+Measures the hand list and statistics queries before and after moving ohh_data out of the hands table (migration 2).
+
+A database with the schema of version 1 (ohh_data stored in hands) is filled with --hands hands, replicated from the
+hands of an OHH file, the queries are timed, the database is migrated to the last version and the queries are timed again.
+
+Usage: python benchmarks/bench_hands_table.py path/to/hands.OHH [--hands 1000000] [--repeat 5]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from blueprints.replayer import get_hands_list, get_hands_count, hands_count_cache, PAGE_SIZE
+from utils.OHH import read_OHH
+
+# Layout of the hands table at version 1, independent of the current HANDS_COLUMNS
+LEGACY_HANDS_COLUMNS = ("id", "game_number", "site_name", "table_name", "date_time", "table_size", "number_players",
+                        "small_blind_amount", "big_blind_amount", "observed", "hero_name", "hero_cards", "hero_hand_class",
+                        "hero_position", "hero_profit", "flop", "players", "ohh_data")
+
+
+def build_legacy_db(db_path, parsed_hands, number_hands):
+    """Creates a version 1 database with number_hands hands, cycling through parsed_hands with new game numbers."""
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(models.SCHEMA)
+    models.migrate_db(db_path, target_version = 1)
+
+    names = sorted({name for _, players_hands_data in parsed_hands for name in players_hands_data})
+    name_to_id = {name: player_id for player_id, name in enumerate(names, start = 1)}
+
+    def hand_rows():
+        for hand_id in range(1, number_hands + 1):
+            hands_data = dict(parsed_hands[hand_id % len(parsed_hands)][0], game_number = str(hand_id))
+            yield (hand_id,) + tuple(hands_data.get(column) for column in LEGACY_HANDS_COLUMNS[1:])
+
+    def players_hands_rows():
+        for hand_id in range(1, number_hands + 1):
+            yield from models.players_hands_rows(hand_id, parsed_hands[hand_id % len(parsed_hands)][1], name_to_id)
+
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO players (id, name) VALUES (?, ?)", ((i, name) for name, i in name_to_id.items()))
+        conn.executemany(models.insert_statement("hands", LEGACY_HANDS_COLUMNS), hand_rows())
+        conn.executemany(models.insert_statement("players_hands", models.PLAYERS_HANDS_COLUMNS), players_hands_rows())
+        conn.commit()
+    return names[0]
+
+
+def uncached_count(db_path, q = None):
+    """Counts the hands without the count cache, which would hide the time of the query."""
+    hands_count_cache.clear(db_path)
+    return get_hands_count(db_path, q)
+
+
+def legacy_update_players_statistics(db_path):
+    """update_players_statistics before the running counters of migration 6: a GROUP BY over all of players_hands,
+    which runs on any version of the schema."""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+        UPDATE players
+        SET hands = result.hands, vpip = result.VPIP, pfr = result.PFR, win_rate = result.bb_per_hand, af = result.AF
+        FROM (SELECT player_id,
+                     COUNT(ph.hand_id) AS hands,
+                     ROUND(CAST(SUM(ph.vpip) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS VPIP,
+                     ROUND(CAST(SUM(ph.pfr) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS PFR,
+                     ROUND(CAST(SUM(ph.aggressive) AS FLOAT) / CAST(SUM(ph.passive) AS FLOAT),2) AS AF,
+                     ROUND(AVG(profit) / h.big_blind_amount,2) AS bb_per_hand
+              FROM players_hands ph JOIN hands h on ph.hand_id == h.id
+              GROUP BY player_id)
+        AS result
+        WHERE players.id = result.player_id
+        """)
+        conn.commit()
+
+
+def time_queries(db_path, player_name, repeat, migrated = True):
+    """Returns the best time in milliseconds of each query.
+    Before the migration (migrated False), the search is not timed as it needs the full text index of the hands
+    (migration 8), and the players statistics are updated by the query of version 1 as the current one needs the
+    counters of migration 6."""
+    with sqlite3.connect(db_path) as conn:
+        # Keyset cursor of page 200: last hand of page 199
+        page_200 = conn.execute("SELECT date_time, id FROM hands ORDER BY date_time DESC, id DESC LIMIT 1 OFFSET ?",
+                                (199 * PAGE_SIZE - 1,)).fetchone()
+    queries = {
+        "hands list, first page": lambda: get_hands_list(db_path, return_count = False),
+        "hands list, page 200": lambda: get_hands_list(db_path, page_200, return_count = False),
+        "hands count": lambda: uncached_count(db_path),
+        "hands count, search": lambda: uncached_count(db_path, player_name),
+        "update players statistics": lambda: (models.update_players_statistics if migrated else legacy_update_players_statistics)(db_path),
+        "player statistics": lambda: models.get_player_statistics(db_path, player_name),
+    }
+    if not migrated:
+        del queries["hands count, search"]
+    results = {}
+    for name, query in queries.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            best = min(best, time.perf_counter() - start)
+        results[name] = best * 1000
+    return results
+
+
+def table_size(db_path, table):
+    """Returns the size in MB of the pages of a table, as reported by the dbstat virtual table."""
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table,)).fetchone()[0] / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ohh_file")
+    parser.add_argument("--hands", type = int, default = 1000000)
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    with open(args.ohh_file, "rb") as f:
+        parsed_hands = [parsed for parsed in map(models.prepare_hand, read_OHH(f)) if parsed[1] is not None]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "bench.db")
+        player_name = build_legacy_db(db_path, parsed_hands, args.hands)
+        before = time_queries(db_path, player_name, args.repeat, migrated = False)
+        size_before = table_size(db_path, "hands")
+        start = time.perf_counter()
+        models.migrate_db(db_path)
+        migration_time = time.perf_counter() - start
+        after = time_queries(db_path, player_name, args.repeat)
+        size_after = table_size(db_path, "hands")
+
+    print(f"{args.hands} hands, migration took {migration_time:.1f} s")
+    print(f"hands table: {size_before:.0f} MB before, {size_after:.0f} MB after")
+    print(f"{'query':<32}{'before (ms)':>14}{'after (ms)':>14}")
+    for name in after:
+        before_time = f"{before[name]:.1f}" if name in before else "-"
+        print(f"{name:<32}{before_time:>14}{after[name]:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
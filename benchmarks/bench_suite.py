@@ -0,0 +1,177 @@
+"""
+End-to-end benchmark suite on synthetic hands (utils.ohh_generator), the results are written to a JSON file so runs
+can be compared to spot regressions.
+
+Benchmarks:
+ - parse: parse_hand_at_upload throughput (hands/sec)
+ - save_hands_bulk: throughput of the writer in a new database (hands/sec), batches of --batch-size hands
+ - statistics: update_players_statistics, the statistics queries of the hero (including his profit curve downsampled
+   to 1000 buckets) and the columnar stats engine (refresh, filtered query and query grouped by hand class), for each
+   database size of --sizes (the database is grown from one size to the next), best time of --repeat runs in ms
+ - replayer: latency of get_replay_timeline (built when a hand is opened) on hands of the database (mean, median,
+   p95 and max in ms) and of timeline_state on their last game state (the one rebuilt from the most deltas)
+
+Usage: python benchmarks/bench_suite.py [--sizes 10000 100000 1000000] [--seed 0] [--output bench_suite.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from utils.hand_parser import parse_hand_at_upload, get_replay_timeline, timeline_state
+from utils.ohh_generator import HandGenerator
+from utils.stats_engine import stats_engine
+
+
+def best_time(function, repeat):
+    """Returns the best time of function() in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_parse(hands, repeat):
+    seconds = best_time(lambda: [parse_hand_at_upload(hand) for hand in hands], repeat) / 1000
+    return {"hands": len(hands), "hands_per_sec": round(len(hands) / seconds)}
+
+
+def bench_save_hands_bulk(hands, batch_size, repeat):
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "bench.db")
+            models.init_db(db_path)
+            models.player_ids_cache.clear(db_path)
+            start = time.perf_counter()
+            for i in range(0, len(hands), batch_size):
+                models.save_hands_bulk(hands[i:i + batch_size], db_path)
+            elapsed = time.perf_counter() - start
+            models.player_ids_cache.clear(db_path)
+            return elapsed
+    seconds = min(run() for _ in range(repeat))
+    return {"hands": len(hands), "batch_size": batch_size, "hands_per_sec": round(len(hands) / seconds)}
+
+
+def bench_statistics(db_path, player_name, repeat):
+    queries = {
+        "update_players_statistics": lambda: models.update_players_statistics(db_path),
+        "get_player_statistics": lambda: models.get_player_statistics(db_path, player_name),
+        "get_player_profit_historique_downsampled": lambda: models.get_player_profit_historique(player_name, db_path, 1000, 10),
+        # The first query loads the hands added since the previous size in the columnar engine
+        "stats_engine_refresh": lambda: stats_engine.statistics(db_path),
+        "stats_engine_filtered_query": lambda: stats_engine.statistics(db_path, group_by = "position", players = [player_name],
+                                                                       min_players = 4, hand_classes = ["AA", "KK", "AKs"]),
+        # Grouped by a categorical column over all the players (unknown cards included), serialized like /statistics/query
+        "stats_engine_grouped_query": lambda: json.dumps(stats_engine.statistics(db_path, group_by = "hand_class"), sort_keys = True),
+    }
+    return {name: round(best_time(query, 1 if name == "stats_engine_refresh" else repeat), 2) for name, query in queries.items()}
+
+
+def bench_replayer(db_path, number_hands, seed):
+    with sqlite3.connect(db_path) as conn:
+        max_id = conn.execute("SELECT MAX(id) FROM hands").fetchone()[0]
+        hand_ids = random.Random(seed).sample(range(1, max_id + 1), min(number_hands, max_id))
+        hands = [json.loads(conn.execute("SELECT ohh_data FROM hands_ohh WHERE hand_id = ?", (hand_id,)).fetchone()[0])
+                 for hand_id in hand_ids]
+    latencies = []
+    state_latencies = []
+    for hand in hands:
+        start = time.perf_counter()
+        timeline = get_replay_timeline(hand)
+        latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        timeline_state(timeline, len(timeline["deltas"]) - 1)
+        state_latencies.append((time.perf_counter() - start) * 1000)
+    return {"hands": len(hands), "timeline": latency_summary(latencies), "state": latency_summary(state_latencies)}
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {"mean_ms": round(statistics.mean(latencies), 4),
+            "median_ms": round(statistics.median(latencies), 4),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 4),
+            "max_ms": round(latencies[-1], 4)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10000, 100000, 1000000])
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--table-sizes", type = int, nargs = "+", default = [2, 3, 4, 5, 6])
+    parser.add_argument("--pool-size", type = int, default = 1000)
+    parser.add_argument("--sample", type = int, default = 5000, help = "Hands used by the parse, writer and replayer benchmarks")
+    parser.add_argument("--batch-size", type = int, default = 500)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = "bench_suite.json")
+    args = parser.parse_args()
+
+    options = {"table_sizes": args.table_sizes, "pool_size": args.pool_size}
+    generator = HandGenerator(seed = args.seed, **options)
+    sample = [generator.ohh() for _ in range(args.sample)]
+    generator.session.hands.clear()
+
+    results = {}
+    results["parse"] = bench_parse(sample, args.repeat)
+    print("parse", results["parse"])
+    results["save_hands_bulk"] = bench_save_hands_bulk(sample, args.batch_size, args.repeat)
+    print("save_hands_bulk", results["save_hands_bulk"])
+
+    results["statistics"] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "bench.db")
+        models.init_db(db_path)
+        # Hands of the statistics database come from another seed than the sample
+        generator = HandGenerator(seed = args.seed + 1, **options)
+        number_hands = 0
+        for size in sorted(args.sizes):
+            def hands():
+                for _ in range(size - number_hands):
+                    yield generator.ohh()
+                    generator.session.hands.clear()
+            start = time.perf_counter()
+            models.save_hands_stream(hands(), db_path, args.batch_size)
+            print(f"database grown to {size} hands in {time.perf_counter() - start:.1f} s")
+            number_hands = size
+            results["statistics"][str(size)] = bench_statistics(db_path, generator.hero_name, args.repeat)
+            print(size, results["statistics"][str(size)])
+
+        results["replayer"] = bench_replayer(db_path, args.sample, args.seed)
+        print("replayer", results["replayer"])
+        models.player_ids_cache.clear(db_path)
+
+    report = {
+        "date": datetime.now().isoformat(timespec = "seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "options": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent = 2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
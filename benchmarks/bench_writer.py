@@ -0,0 +1,99 @@
+"""
+Compares the hands/sec of the executemany hands writer (models.insert_parsed_hands) with the previous
+pandas based writer (one DataFrame per hand and to_sql(method="multi")).
+
+Usage: python benchmarks/bench_writer.py path/to/hands.OHH [--repeat 3]
+Only the writing is timed, the hands are parsed once before the runs.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import models
+from utils.OHH import read_OHH
+
+
+def legacy_pandas_writer(parsed_hands, db_path):
+    """Writer used by save_hands_bulk before the executemany writer, kept here as the reference."""
+    hands_dics = []
+    players = set()
+    players_hands_dics = []
+    for hands_data, players_hands_data in parsed_hands:
+        if players_hands_data is None:
+            continue
+        hands_dics.append(hands_data)
+        players_hands_dics.append(players_hands_data)
+        for name in players_hands_data.keys(): players.add(name)
+
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM hands")
+        max_id = cursor.fetchone()[0] or 0
+
+        # The frame is built from the current columns of hands, the OHH JSON goes to hands_ohh (migration 2)
+        hands_df = pd.DataFrame.from_dict(hands_dics).reindex(columns = models.HANDS_COLUMNS[1:])
+        hands_df.to_sql(name = 'hands', con = conn, if_exists='append', index=False,
+                        chunksize= 999 // (len(hands_df.columns)+1), method="multi")
+        hand_ids = range(max_id + 1, max_id + 1 + len(hands_dics))
+        ohh_df = pd.DataFrame({"hand_id": hand_ids, "ohh_data": [hands_data["ohh_data"] for hands_data in hands_dics]})
+        ohh_df.to_sql(name = 'hands_ohh', con = conn, if_exists='append', index=False, chunksize= 999 // 3, method="multi")
+
+        name_to_id = {}
+        for name in players:
+            cursor.execute("SELECT id FROM players WHERE name = ?", (name,))
+            result = cursor.fetchone()
+            if result:
+                name_to_id[name] = result[0]
+            else:
+                cursor.execute("INSERT INTO players (name) VALUES (?)", (name,))
+                name_to_id[name] = cursor.lastrowid
+
+        players_hands_df_list = []
+        for hand_id, players_hands in zip(hand_ids, players_hands_dics) :
+            df = pd.DataFrame(data = players_hands).T.reset_index(names = 'player_id')
+            df['player_id'] = df['player_id'].apply(lambda name : name_to_id[name])
+            df["hand_id"] = hand_id
+            players_hands_df_list.append(df)
+        players_hands_df = pd.concat(players_hands_df_list, ignore_index=True)
+        players_hands_df.to_sql(name = 'players_hands', con = conn, if_exists='append', index=False,
+                                chunksize= 999 // (len(players_hands_df.columns)+1), method="multi")
+        conn.commit()
+    return len(hands_dics)
+
+
+def run(writer, parsed_hands, batch_size):
+    """Writes all the hands in a new database with the given writer and returns the elapsed time."""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "bench.db")
+        models.init_db(db_path)
+        start = time.perf_counter()
+        for i in range(0, len(parsed_hands), batch_size):
+            writer(parsed_hands[i:i + batch_size], db_path)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ohh_file")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--batch-size", type = int, default = 500)
+    args = parser.parse_args()
+
+    with open(args.ohh_file, "rb") as f:
+        parsed_hands = [models.prepare_hand(hand) for hand in read_OHH(f)]
+    print(f"{len(parsed_hands)} hands, batches of {args.batch_size}")
+
+    writers = {"pandas to_sql": legacy_pandas_writer, "executemany": models.insert_parsed_hands}
+    for name, writer in writers.items():
+        best = min(run(writer, parsed_hands, args.batch_size) for _ in range(args.repeat))
+        print(f"{name:>14}: {len(parsed_hands) / best:10.0f} hands/sec ({best:.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Checks with EXPLAIN QUERY PLAN that the core queries of the application don't do full table scans.
+
+A database is filled with synthetic hands (utils.ohh_generator), the functions behind the hands list, the players list,
+the statistics and the replayer are run with every SQL statement traced, and the plan of each SELECT is checked.
+Scanning an index (e.g. counting the hands), a virtual table and its shadow tables (the FTS5 search index reads its
+configuration), the schema (the data version reads the root page of players_hands), a subquery or a common table
+expression (their rows are bounded by their own plan) is allowed, scanning a table is not.
+Exits with status 1 if a query does a full scan, so it can be run in CI.
+
+Usage: python benchmarks/check_query_plans.py [--hands 2000]
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from blueprints.replayer import get_hands_list, get_hands_count, get_neighbour_hands, hands_count_cache, page_cursor
+from utils.ohh_generator import HandGenerator, generate_hands
+
+
+def core_queries(db_path, player_name):
+    """Functions whose queries must not scan tables."""
+    second_page = page_cursor(get_hands_list(db_path, return_count = False))
+    return {
+        "hands list": lambda: get_hands_list(db_path, return_count = False),
+        "hands list, next page": lambda: get_hands_list(db_path, second_page, return_count = False),
+        "hands count": lambda: get_hands_count(db_path),
+        "hands search, rare term": lambda: get_hands_list(db_path, q = player_name[:-1] + "1"),
+        "hands search, frequent term": lambda: get_hands_list(db_path, q = player_name),
+        "hands search, next page": lambda: get_hands_list(db_path, second_page, player_name),
+        "hands search, hand class": lambda: get_hands_list(db_path, q = "AK"),
+        "hands search, name prefix": lambda: get_hands_list(db_path, q = player_name[:2]),
+        "next hands": lambda: get_neighbour_hands(db_path, second_page[1], number = 5),
+        "previous hands, search": lambda: get_neighbour_hands(db_path, second_page[1], player_name, 5, "previous"),
+        "players list": lambda: models.get_players_list(db_path),
+        "player page statistics": lambda: models.get_player_statistics(db_path, player_name),
+        "player opening range": lambda: models.get_player_hand_classes(db_path, player_name, "BU"),
+        "player profit history": lambda: models.get_player_profit_historique(player_name, db_path),
+        "replayer hand": lambda: models.get_db_connection(db_path).execute("SELECT ohh_data FROM hands_ohh WHERE hand_id = ?", (1,)),
+    }
+
+
+def traced_statements(function):
+    """Runs function and returns the SQL statements it executed, with their parameters."""
+    statements = []
+    connect = sqlite3.connect
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+    sqlite3.connect = traced_connect
+    try:
+        function()
+    finally:
+        sqlite3.connect = connect
+    return statements
+
+
+def full_scans(db_path, statement):
+    """Returns the full table scans of the plan of a statement."""
+    with sqlite3.connect(db_path) as conn:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+    common_tables = re.findall(r"(\w+)\s+AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?\(", statement, re.IGNORECASE)
+    return [step for step in plan if step.startswith("SCAN") and "INDEX" not in step and "VIRTUAL TABLE" not in step
+            and not step.startswith(("SCAN (subquery", "SCAN main.hands_search_", "SCAN CONSTANT ROW", "SCAN sqlite_master"))
+            and step.split()[1] not in common_tables]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hands", type = int, default = 2000)
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "plans.db")
+        models.init_db(db_path)
+        models.save_hands_stream(generate_hands(args.hands, table_sizes = (2, 3, 4, 5, 6), pool_size = 100), db_path)
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("ANALYZE")
+
+        for name, function in core_queries(db_path, HandGenerator().hero_name).items():
+            hands_count_cache.clear(db_path) # The counts are queried, not read from the cache
+            for statement in traced_statements(function):
+                if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                    continue
+                scans = full_scans(db_path, statement)
+                print(f"{'FULL SCAN' if scans else 'ok':<10}{name}" + (f": {', '.join(scans)}" if scans else ""))
+                failures += bool(scans)
+        models.player_ids_cache.clear(db_path)
+
+    if failures:
+        print(f"{failures} queries do full scans")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
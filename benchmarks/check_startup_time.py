@@ -0,0 +1,70 @@
+"""
+Checks that the application starts fast: `import run` (which creates the application) is timed with python -X importtime
+in a new interpreter, and the check fails if the import time goes over a budget or if a heavy dependency (numpy,
+pandas, matplotlib, seaborn) is imported at startup. Those are loaded by the code paths that need them.
+
+HOME is set to a temporary directory, so the application starts with empty data directories.
+Exits with status 1 if the check fails, so it can be run in CI.
+
+Usage: python benchmarks/check_startup_time.py [--budget-ms 800] [--repeat 3] [--top 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that must not be imported when the application starts
+LAZY_MODULES = ("numpy", "pandas", "matplotlib", "seaborn")
+
+
+def import_times(home):
+    """Imports run in a new interpreter and returns the (module, self us, cumulative us) of every import."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import run"], cwd = ROOT, capture_output = True,
+                            text = True, env = dict(os.environ, HOME = home))
+    if result.returncode != 0:
+        sys.exit(f"import run failed:\n{result.stderr}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((module.rstrip()[1:], int(self_time), int(cumulative))) # Indented by 2 spaces per nesting level
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type = float, default = 800, help = "Maximum import time of run")
+    parser.add_argument("--repeat", type = int, default = 3, help = "The best of the runs is compared to the budget")
+    parser.add_argument("--top", type = int, default = 10, help = "Number of slowest imports printed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        runs = [import_times(home) for _ in range(args.repeat)]
+    # Top level imports are not indented, their cumulative times add up to the whole import
+    totals = [sum(cumulative for module, _, cumulative in imports if not module.startswith(" ")) / 1000 for imports in runs]
+    best = min(range(len(runs)), key = totals.__getitem__)
+    imports = runs[best]
+
+    print(f"import run: {totals[best]:.0f} ms (best of {args.repeat}, budget {args.budget_ms:.0f} ms)")
+    print("Slowest imports (cumulative ms):")
+    for module, _, cumulative in sorted(imports, key = lambda row: row[2], reverse = True)[:args.top]:
+        print(f"{cumulative / 1000:>10.1f}  {module.strip()}")
+
+    failures = []
+    if totals[best] > args.budget_ms:
+        failures.append(f"import time {totals[best]:.0f} ms is over the budget of {args.budget_ms:.0f} ms")
+    loaded = sorted({module.strip().split(".")[0] for module, _, _ in imports} & set(LAZY_MODULES))
+    if loaded:
+        failures.append(f"heavy dependencies imported at startup: {', '.join(loaded)}")
+    for failure in failures:
+        print("FAILED", failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-from flask import Blueprint, request, jsonify, session, render_template, current_app, redirect
+from flask import Blueprint, request, jsonify, session, render_template, current_app, redirect, make_response
 from models import get_db_connection, load_hands_from_db
-from utils.hand_parser import get_data_for_replayer
+from utils.hand_parser import timeline_state
+from utils import import_jobs
+from utils.replay_store import replay_store
+from utils.lru_cache import LRUCache, register_database_cache
 from werkzeug.utils import secure_filename
+from config import Config
+import hashlib
+import tempfile
 import time
 import models
 import json
@@ -10,24 +16,81 @@ import os
 replayer_bp = Blueprint('replayer', __name__)
 
 
+SEARCH_COUNT_LIMIT = 10000 # Hands counted at most for a search, more matches are displayed as "10000+"
+PAGE_SIZE = 50 # Hands loaded at a time by the infinite scroll of the hands list
+
+# Number of hands of each search (q, None for all the hands), keyed by (database, q). A count is stored with the data
+# version of its database (see models.data_version) and reused until it changes.
+hands_count_cache = register_database_cache(LRUCache(Config.HANDS_COUNT_CACHE_SIZE))
+
+def search_condition(q, selective = True, limit = None):
+    """Returns the condition and its parameters selecting the hands matching the search q ("" if q is empty).
+    Searches of 3 characters or more match any substring (case insensitive) of the players, the table name or the hand
+    class of the hero. Shorter searches match the beginning (case sensitive) of a player name, of the table name or of
+    the hand class of the hero (e.g. AK).
+    If selective, matches are found with the indexes (trigram index hands_search, players names, hands_table_name,
+    hands_hand_class), the best when few hands match as they are then sorted by date. Else the condition is checked on
+    the hands read in date order, the best when many hands match as a page is filled after a few hands.
+    limit caps the hands matched through the players names of a short selective search, for the capped counts."""
+    if not q:
+        return "", ()
+    if len(q) < 3:
+        if not selective:
+            # players is the list of the players names separated by ", "
+            return "(substr(hero_hand_class, 1, ?) = ? OR substr(table_name, 1, ?) = ? OR instr(', ' || players, ?))",\
+                   (len(q), q, len(q), q, ", " + q)
+        # The strings starting with q are the ones in [q, q with its last character incremented)
+        bounds = (q, q[:-1] + chr(ord(q[-1]) + 1))
+        players = "SELECT DISTINCT ph.hand_id FROM players p JOIN players_hands ph ON ph.player_id = p.id WHERE p.name >= ? AND p.name < ?"
+        condition = f"""((hero_hand_class >= ? AND hero_hand_class < ?) OR (table_name >= ? AND table_name < ?)
+                     OR id IN ({players}{" LIMIT ?" if limit else ""}))"""
+        return condition, bounds * 3 + ((limit,) if limit else ())
+    if selective:
+        # Quoted as a FTS5 string so the search is a plain substring whatever its characters
+        return "id IN (SELECT rowid FROM hands_search WHERE hands_search MATCH ?)", ('"' + q.replace('"', '""') + '"',)
+    condition = " OR ".join(f"instr(lower({column}), lower(?))" for column in ("players", "table_name", "hero_hand_class"))
+    return f"({condition})", (q,) * 3
+
 def get_hands_count(db_path, q = None):
+    """Returns the number of hands matching the search q, counted up to SEARCH_COUNT_LIMIT if q is given.
+    Counts are cached until hands are inserted (see hands_count_cache)."""
+    q = q or None
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        query = f"""
-        SELECT COUNT(id) AS count
-        FROM hands
-        """
-        if q is not None:
-            query += f"WHERE players GLOB '*{q}*' OR table_name GLOB '*{q}*' OR hero_hand_class GLOB '*{q}*'"
-        cursor.execute(query)
+        # The version is read before counting, so a count racing with an import is at worst recounted
+        version = models.data_version(cursor)
+        cached_version, count = hands_count_cache.get((db_path, q), (None, None))
+        if cached_version == version:
+            return count
+        if q and len(q) >= 3:
+            # Counted on the index directly, "id IN" would first read all the matches
+            cursor.execute("SELECT COUNT(*) AS count FROM (SELECT 1 FROM hands_search WHERE hands_search MATCH ? LIMIT ?)",
+                           (*search_condition(q)[1], SEARCH_COUNT_LIMIT))
+        elif q:
+            # The hands of the matching players are read up to the limit too, "id IN" would first read all of them
+            condition, parameters = search_condition(q, limit = SEARCH_COUNT_LIMIT)
+            cursor.execute(f"SELECT COUNT(*) AS count FROM (SELECT 1 FROM hands WHERE {condition} LIMIT ?)", (*parameters, SEARCH_COUNT_LIMIT))
+        else:
+            cursor.execute("SELECT COUNT(id) AS count FROM hands")
         count = cursor.fetchone()["count"]
+    hands_count_cache.add((db_path, q), (version, count))
     return count 
 
-def get_hands_list(db_path, page = 1, q = None, return_count = True):
-    # q is the search filter
+def display_count(count, q = None):
+    """Returns the number of hands displayed above the hands list."""
+    return f"{count}+" if q and count >= SEARCH_COUNT_LIMIT else count
 
-    limit = 50                              # Default items per page
-    offset = (page - 1) * limit             # Calculate offset
+def get_hands_list(db_path, after = None, q = None, return_count = True):
+    """Returns the PAGE_SIZE most recent hands matching the search q, and their number if return_count.
+    The hands are ordered by (date_time, id) descending and paged by keyset: after is the (date_time, id) of the last
+    hand of the previous page (None for the first page, see page_cursor), so every page is a seek in hands_date_time
+    whatever its depth."""
+    count = get_hands_count(db_path, q) if q else None
+    condition, parameters = search_condition(q, selective = count is not None and count < SEARCH_COUNT_LIMIT)
+    conditions = [condition] if condition else []
+    if after is not None:
+        conditions.append("(date_time, id) < (?, ?)")
+        parameters += tuple(after)
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
         query = f"""
@@ -39,27 +102,55 @@ def get_hands_list(db_path, page = 1, q = None, return_count = True):
         hero_profit AS profit,
         players
         FROM hands
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY date_time DESC, id DESC LIMIT ?
         """
-        if q is not None:
-            query += f"WHERE players GLOB '*{q}*' OR table_name GLOB '*{q}*' OR hero_hand_class GLOB '*{q}*'"
-        query += f"ORDER BY date_time DESC LIMIT {limit} OFFSET {offset}"
-        cursor.execute(query)
+        cursor.execute(query, (*parameters, PAGE_SIZE))
         results = cursor.fetchall()
 
     if return_count:
-        count = get_hands_count(db_path, q)
-        return results, count
+        return results, display_count(count if q else get_hands_count(db_path), q)
 
     return results
 
+def get_neighbour_hands(db_path, hand_id, q = None, number = 1, direction = "next"):
+    """Returns the ids of the number hands after (direction "next", older) or before ("previous", more recent) hand_id
+    in the hands list of the search q, the closest first. Like the pages, they are found by a seek in hands_date_time."""
+    count = get_hands_count(db_path, q) if q else None
+    condition, parameters = search_condition(q, selective = count is not None and count < SEARCH_COUNT_LIMIT)
+    comparison, order = ("<", "DESC") if direction == "next" else (">", "ASC")
+    conditions = [f"(date_time, id) {comparison} (SELECT date_time, id FROM hands WHERE id = ?)"] + ([condition] if condition else [])
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id FROM hands WHERE {' AND '.join(conditions)} ORDER BY date_time {order}, id {order} LIMIT ?",
+                       (hand_id, *parameters, number))
+        return [row["id"] for row in cursor.fetchall()]
+
+def prefetch_neighbour_hands(db_path, hand_id):
+    """Builds in the background the replays of the Config.REPLAY_PREFETCH_HANDS hands before and after hand_id in the
+    hands list of the session, so opening them, from the list or with next_hand and previous_hand, skips the parsing."""
+    if Config.REPLAY_PREFETCH_HANDS <= 0:
+        return
+    q = session.get("filter", None)
+    hand_ids = [neighbour for direction in ("next", "previous")
+                for neighbour in get_neighbour_hands(db_path, hand_id, q, Config.REPLAY_PREFETCH_HANDS, direction)]
+    replay_store.prefetch(db_path, hand_ids)
+
+def page_cursor(hands_list, after = None):
+    """Returns the keyset cursor of the page following hands_list (after, the cursor of hands_list, if it is empty)."""
+    if not hands_list:
+        return after
+    return (hands_list[-1]["date_time"], hands_list[-1]["id"])
+
 @replayer_bp.route('/')
 def replayer():
     db_path = session.get("db_path", None)
     if db_path is None : return redirect('/')
-    session["page"] = 1
     session["filter"] = None
-    hands_list, count = get_hands_list(db_path, session["page"])
-    return render_template('replayer_page.html', hands_list = hands_list, total_count = count)
+    hands_list, count = get_hands_list(db_path)
+    session["after"] = page_cursor(hands_list)
+    import_job = import_jobs.get_import_job(db_path)
+    return render_template('replayer_page.html', hands_list = hands_list, total_count = count, import_job = import_job)
 
 @replayer_bp.route('/upload', methods=['POST'])
 def upload():
@@ -68,100 +159,159 @@ def upload():
 
     files = request.files.getlist('file')  # Get all files uploaded as 'file'
     len_files = len(files)
-    upload_path = current_app.config["UPLOADS_PATH"]
 
+    # Files are saved in their own directory of the uploads folder and imported in the background by an import job
+    upload_dir = tempfile.mkdtemp(dir = current_app.config["UPLOADS_PATH"])
+    file_paths = []
     for num, file in enumerate(files):
-        print(type(file))
         if file.filename == '':
             continue  # Skip empty filenames
 
-        if file.filename.split('.')[-1] != ".OHH":
+        if file.filename.split('.')[-1] != "OHH":
             print(f"File {file.filename} skipped, it's not an OHH file. ({num+1}/{len_files})")
             message = "Some files were skipped because their file extension was not OHH"
             continue
-        
-        file_path = upload_path + "tmp.OHH"
-        file.save(file_path)  # Save file to uploads directory
 
-        with open(file_path, 'r') as f:
-            hand_data_list = [json.loads(hand.strip()) for hand in f.read().split('\n\n') if hand.strip()]
-            models.save_hands_bulk(hand_data_list, session["db_path"])
-            new_files_uploaded = True
-            print(f"File {file.filename} was uploaded. ({num+1}/{len_files})")
+        file_path = os.path.join(upload_dir, f"{num}_{secure_filename(file.filename)}")
+        file.save(file_path)  # Copied by chunks, the file is never fully loaded in memory
+        file_paths.append(file_path)
+
+    if not file_paths:
+        os.rmdir(upload_dir)
+        return render_template("import_status.html", job = import_jobs.get_import_job(db_path), message = message)
+
+    job_id = import_jobs.submit_import_job(db_path, file_paths)
+    print(f"Import job {job_id} created for {len(file_paths)} file(s).")
+
+    return render_template("import_status.html", job = import_jobs.get_import_job(db_path, job_id), message = message)
 
-    hands_list, count = get_hands_list(db_path, session["page"], session["filter"]) 
+@replayer_bp.route('/import_folder', methods=['POST'])
+def import_folder():
+    db_path = session["db_path"]
+    folder = os.path.expanduser(request.form.get("folder", "").strip())
+    if not os.path.isdir(folder):
+        return render_template("import_status.html", job = import_jobs.get_import_job(db_path), message = "Folder not found")
 
-    return render_template("hands_table.html", hands_list=hands_list, total_count = count, message = message) 
+    job_id = import_jobs.submit_import_job(db_path, folder = folder)
+    print(f"Import job {job_id} created for folder {folder}.")
 
+    return render_template("import_status.html", job = import_jobs.get_import_job(db_path, job_id))
 
+@replayer_bp.route('/import_status')
+def import_status():
+    db_path = session.get("db_path", None)
+    job = import_jobs.get_import_job(db_path, request.args.get("job_id"))
+    response = make_response(render_template("import_status.html", job = job))
+    if job is not None and job["status"] in ("done", "failed"):
+        response.headers["HX-Trigger"] = "importFinished" # Refreshes the hands table
+    return response
 
 @replayer_bp.route("/search")
 def search():
     db_path = session.get("db_path", None)
     search_filter = request.args.get("filter")
     session["filter"] = search_filter
-    session["page"] = 1
-    hands_list, count = get_hands_list(db_path, 1, search_filter) 
+    hands_list, count = get_hands_list(db_path, q = search_filter)
+    session["after"] = page_cursor(hands_list)
     return render_template("hands_table.html", hands_list=hands_list, total_count = count)
 
 
 @replayer_bp.route("/load_next_page")
 def load_next_page():
     db_path = session.get("db_path", None)
-    page = session["page"] +1
-    session["page"] = page
-    hands_list = get_hands_list(db_path, page, session.get("filter", None), return_count = False) 
+    after = session.get("after", None)
+    hands_list = get_hands_list(db_path, after, session.get("filter", None), return_count = False)
+    session["after"] = page_cursor(hands_list, after)
     return render_template("hands_list.html", hands_list=hands_list)
 
 @replayer_bp.route('/select_hand')
 def select_hand():
-    selected_index = request.args.get('selected_hand')
+    hand_id = request.args.get('selected_hand', type = int)
+    if replay_store.get(session["db_path"], hand_id) is None:
+        return jsonify({"error": "Invalid hand selection"}), 400
 
-    # Retrieve the full ohh_data from the database for the selected hand
-    with get_db_connection(session["db_path"]) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT ohh_data FROM hands WHERE id=?", (selected_index,))
-        result = cursor.fetchone()
-        if not result:
-            return jsonify({"error": "Invalid hand selection"}), 400
-        
-        # Load ohh_data and parse it
-        ohh_data = json.loads(result["ohh_data"])
-        general_data, game_states = get_data_for_replayer(ohh_data)
-
-    session["general_data"] = general_data
-    session["game_states"] = game_states
+    # The replay is kept by replay_store, the session only holds the hand and the state it was opened at
+    session.pop("general_data", None)
+    session.pop("game_states", None)
+    session["replay_hand_id"] = hand_id
     session["current_state"] = 0 # Change here the default loaded state
+    prefetch_neighbour_hands(session["db_path"], hand_id)
+    return render_replay(session["current_state"])
+
+def open_neighbour_hand(direction):
+    """Opens the hand after or before the replayed hand in the hands list of the session (it stays open if there is none)."""
+    db_path = session.get("db_path", None)
+    hand_id = session.get("replay_hand_id")
+    if db_path is None or hand_id is None:
+        return jsonify({"error": "No hand selected"}), 400
+    neighbours = get_neighbour_hands(db_path, hand_id, session.get("filter", None), 1, direction)
+    if not neighbours:
+        return render_replay(replay_cursor())
+    session["replay_hand_id"] = neighbours[0]
+    session["current_state"] = 0
+    prefetch_neighbour_hands(db_path, neighbours[0])
+    return render_replay(session["current_state"])
+
+@replayer_bp.route("/next_hand")
+def next_hand():
+    return open_neighbour_hand("next")
 
-    return render_template("hand_replayer.html", general_data=general_data, gamestate=game_states[session["current_state"]]) 
+@replayer_bp.route("/previous_hand")
+def previous_hand():
+    return open_neighbour_hand("previous")
+
+def render_replay(state):
+    """Renders the state number state (the last one if None) of the replayed hand of the session.
+    The page embeds the replay, so opening a hand is a single request and the browser then steps through it alone.
+    The pages link to the states around theirs (see replay_cursor), so stepping through a hand never modifies the session."""
+    timeline = replay_store.get(session["db_path"], session.get("replay_hand_id"))
+    if timeline is None:
+        return jsonify({"error": "No hand selected"}), 400
+    last_state = len(timeline["deltas"]) - 1
+    state = last_state if state is None else min(max(state, 0), last_state)
+    return render_template("hand_replayer.html", general_data = timeline["general_data"], gamestate = timeline_state(timeline, state),
+                           state = state, hand_id = session["replay_hand_id"], replay_timeline = browser_timeline(timeline))
+
+def browser_timeline(timeline):
+    """Returns the part of a timeline sent to table_navigation.js, which steps through it in the browser.
+    The checkpoints are left out: the browser builds every game state from the previous one."""
+    return {field: timeline[field] for field in ("general_data", "initial", "deltas", "final_pots")}
+
+def replay_cursor():
+    """Returns the state displayed by the page sending the request, given in its links, else the state the hand was opened at."""
+    return request.args.get("state", session.get("current_state", 0), type = int)
 
 @replayer_bp.route("/beginning")
 def beginning():
-    session["current_state"] = 0
-    return render_template("hand_replayer.html",
-                           general_data=session["general_data"],
-                           gamestate=session["game_states"][0])
+    return render_replay(0)
 
 @replayer_bp.route("/previous")
 def previous():
-    if session["current_state"] > 0 :
-        session["current_state"] -= 1
-    return render_template("hand_replayer.html",
-                           general_data=session["general_data"],
-                           gamestate=session["game_states"][session["current_state"]])
-
+    return render_replay(replay_cursor() - 1)
 
 @replayer_bp.route("/next")
 def next():
-    if session["current_state"] < len(session["game_states"]) -1 :
-        session["current_state"] += 1
-    return render_template("hand_replayer.html",
-                           general_data=session["general_data"],
-                           gamestate=session["game_states"][session["current_state"]])
+    return render_replay(replay_cursor() + 1)
 
 @replayer_bp.route("/end")
 def end():
-    session["current_state"] = len(session["general_data"]) -1
-    return render_template("hand_replayer.html",
-                           general_data=session["general_data"],
-                           gamestate=session["game_states"][-1])
+    return render_replay(None)
+
+@replayer_bp.route("/timeline/<int:hand_id>")
+def timeline(hand_id):
+    """Returns the replay of a hand as JSON (see browser_timeline), the same one as embedded in the replayer pages.
+    The ETag is a hash of the content, a client which already has the replay gets a 304 instead."""
+    timeline = replay_store.get(session.get("db_path"), hand_id)
+    if timeline is None:
+        return jsonify({"error": "Invalid hand selection"}), 404
+    data = json.dumps(browser_timeline(timeline), separators = (",", ":"))
+    response = current_app.response_class(data, mimetype = "application/json")
+    response.set_etag(hashlib.sha1(data.encode()).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.no_cache = True # Revalidated with the ETag, the hand ids of a database name can be reused
+    return response.make_conditional(request)
+
+@replayer_bp.route("/replay_store")
+def replay_store_statistics():
+    """Returns the counters of the replay store shared by the sessions (size, hits, misses), to check its hit rate."""
+    return jsonify(replay_store.statistics())
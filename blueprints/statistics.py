@@ -1,7 +1,9 @@
-from flask import Blueprint, request, jsonify, session, render_template, current_app, redirect, send_file
+from flask import Blueprint, request, jsonify, session, render_template, current_app, redirect, send_file, url_for
 from models import *
 from utils.plots import *
+from utils.stats_engine import stats_engine
 from collections import defaultdict
+from io import BytesIO
 import json
 
 statistics_bp = Blueprint('statistics', __name__)
@@ -11,8 +13,7 @@ def statistics():
     db_path = session.get("db_path", None)
     if db_path is None : return redirect('/')
 
-    # Update and retrieve overall statistics
-    update_players_statistics(session["db_path"])
+    # The statistics of the players are kept up to date by the imports
     players = get_players_list(session["db_path"])
     
     # Get selected player from query parameters
@@ -24,10 +25,12 @@ def statistics():
     position_stats_short = None
 
     if selected_player :
-        position_stats = get_player_statistics_per_position(db_path, selected_player, min_players = 4)
-        position_stats_short = get_player_statistics_per_position(db_path, selected_player, max_players = 3)
-        player_stats = get_player_full_statistics(db_path, selected_player, min_players = 4)
-        player_stats_short = get_player_full_statistics(db_path, selected_player, max_players = 3)
+        # Statistics of 4 to 6 players and of 2 or 3 players tables, with a single query
+        statistics = get_player_statistics(db_path, selected_player)
+        position_stats = statistics["full"]["positions"]
+        player_stats = statistics["full"]["total"]
+        position_stats_short = statistics["short"]["positions"]
+        player_stats_short = statistics["short"]["total"]
 
     # if selected_player is None: selected_player = stats[0]["name"] # By default select the player with the greater number of hands
 
@@ -40,6 +43,42 @@ def statistics():
                            position_stats_short = position_stats_short,
                            )
 
+@statistics_bp.route('/rebuild', methods=['POST'])
+def rebuild():
+    """Maintenance action: recomputes the statistics of every player from all their hands."""
+    db_path = session.get("db_path", None)
+    if db_path is None : return redirect('/')
+    update_players_statistics(db_path)
+    return redirect(url_for('statistics.statistics'))
+
+@statistics_bp.route('/query')
+def query():
+    """Ad-hoc statistics computed by the columnar stats engine, e.g. /statistics/query?player=Hero&position=BU&position=CO&group_by=hand_class
+    Every filter of StatsEngine.statistics can be given, the list filters (player, position, stakes, hand_class) can be repeated."""
+    db_path = session.get("db_path")
+    if not db_path:
+        return jsonify({"error": "No database selected"}), 400
+
+    def values(name):
+        return request.args.getlist(name) or None
+
+    try:
+        statistics = stats_engine.statistics(
+            db_path,
+            group_by = request.args.get("group_by"),
+            players = values("player"),
+            positions = values("position"),
+            min_players = request.args.get("min_players", type = int),
+            max_players = request.args.get("max_players", type = int),
+            stakes = values("stakes"),
+            date_from = request.args.get("date_from"),
+            date_to = request.args.get("date_to"),
+            hand_classes = values("hand_class"),
+        )
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    return jsonify(statistics)
+
 @statistics_bp.route('/player_stats_plot')
 def player_stats_plot():
     db_path = session.get("db_path")
@@ -48,8 +87,9 @@ def player_stats_plot():
     if not db_path or not player_name:
         return jsonify({"error": "Database path or player name missing"}), 400
 
-    img = generate_cummulative_profit_plot(player_name, db_path, window_size)
-    return send_file(img, mimetype="image/png")
+    plot = get_plot(db_path, "profit", player_name, generate_cummulative_profit_plot, window_size = window_size,
+                    date_from = request.args.get("date_from") or None, date_to = request.args.get("date_to") or None)
+    return send_plot(plot)
 
 @statistics_bp.route('/player_opening_range_plot')
 def player_opening_range_plot():
@@ -57,7 +97,27 @@ def player_opening_range_plot():
     player_name = request.args.get('name')
     if not player_name:
         return jsonify({"error": "Player name missing"}), 400
-    img = generate_opening_range_plot(player_name, db_path)
-    return send_file(img, mimetype="image/png")
+    plot = get_plot(db_path, "opening_range", player_name, generate_opening_range_plot, **opening_range_filters())
+    return send_plot(plot)
+
+@statistics_bp.route('/player_opening_range')
+def player_opening_range():
+    """Returns the opening range of a player as JSON: the 13x13 matrix of get_opening_range_matrix.
+    Same query parameters as the PNG: name, position (optional) and bucket (optional, repeatable, see STATISTICS_BUCKETS)."""
+    db_path = session.get("db_path")
+    player_name = request.args.get('name')
+    if not db_path or not player_name:
+        return jsonify({"error": "Database path or player name missing"}), 400
+    return jsonify(player = player_name, **opening_range_filters(),
+                   matrix = get_opening_range_matrix(player_name, db_path, **opening_range_filters()))
+
+def opening_range_filters():
+    """Returns the position and buckets filters of the opening range routes."""
+    return {"position": request.args.get("position") or None, "buckets": tuple(request.args.getlist("bucket")) or None}
+
+def send_plot(plot):
+    """Sends a cached plot, or a 304 if the browser already has it (If-None-Match or If-Modified-Since)."""
+    return send_file(BytesIO(plot["png"]), mimetype = "image/png", etag = plot["etag"], last_modified = plot["last_modified"],
+                     conditional = True)
 
 
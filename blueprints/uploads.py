@@ -1,6 +1,8 @@
 from flask import Blueprint, request, url_for, render_template, make_response, current_app, session
 from flask_session import Session
 from models import * 
+from utils import import_jobs
+from utils.lru_cache import forget_database
 import os
 import json
 
@@ -50,6 +52,8 @@ def load_database():
 
     # Build the database path and store it in the session
     db_path = os.path.join(current_app.config['DB_DIRECTORY'], f"{db_name}.db")
+    migrate_db(db_path) # Upgrade databases created by older versions
+    import_jobs.resume_import_jobs(db_path) # Jobs interrupted by a restart of the server
     session["db_path"] = db_path  # Set the session with the selected database path
     response = make_response('', 200)
     response.headers['HX-Redirect'] = '/replayer'
@@ -65,7 +69,13 @@ def delete_database():
         return render_template('databases_dropDown.html', databases=databases, message = 'Please select a database')
 
     db_path = os.path.join(current_app.config['DB_DIRECTORY'], f"{db_name}.db")
-    os.remove(db_path)
+    # Its jobs must not write to it anymore, nor create it again
+    import_jobs.cancel_import_jobs(db_path)
+    # With WAL, a stale -wal file would be replayed into a new database of the same name
+    for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    forget_database(db_path)
     if session["db_path"] == db_path : session["db_path"] = None # Set the session db_path to None if deleted database was the loaded one 
 
     databases = list_databases(current_app.config['DB_DIRECTORY'])
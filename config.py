@@ -10,11 +10,20 @@ class Config:
     SESSION_FILE_DIR = os.path.join(Path.home(), data_path, "sessions")
     SESSION_PERMANENT = True
     SESSION_USE_SIGNER = True
+    SESSION_REFRESH_EACH_REQUEST = False # The session file is only written when the session is modified
     UPLOADS_PATH = os.path.join(Path.home(), data_path, "uploads/")
     DB_DIRECTORY = os.path.join(Path.home(), data_path, "databases/")
+    UPLOAD_BATCH_SIZE = 500 # Number of hands parsed and committed together when importing OHH files
+    PLAYER_ID_CACHE_SIZE = 100000 # Maximum number of player ids kept in memory during imports, all databases together
+    HANDS_COUNT_CACHE_SIZE = 1000 # Maximum number of hands list counts (one per database and search) kept in memory
+    PLOT_CACHE_MAX_BYTES = 50 * 1024 * 1024 # Maximum total size of the PNG images of the statistics plots kept in memory
+    REPLAY_STORE_MAX_BYTES = 32 * 1024 * 1024 # Maximum total size of the hand replays (timelines of the replayer) kept in memory
+    REPLAY_PREFETCH_HANDS = 5 # Number of hands before and after an opened hand in the hands list whose replays are built in the background (0 to disable)
+    REPLAY_WARM_UP_HANDS = 50 # Number of most recent hands whose replays are built after each import (0 to disable)
+    PARSE_WORKERS = 1 # Number of processes used to parse hands during imports (1 parses in the request process, 0 uses all CPU cores)
 
 
-    # Ensure all directories exist
+    # Ensure all directories exist, called by app.create_app (importing the configuration has no side effect)
     @staticmethod
     def ensure_directories():
         directories = [
@@ -26,6 +35,3 @@ class Config:
             if not os.path.exists(directory):
                 os.makedirs(directory)
                 print(f"Created directory: {directory}")
-
-# Call the directory creation function when the module is loaded
-Config.ensure_directories()
@@ -4,12 +4,15 @@ import sqlite3
 from config import Config
 import os
 import json
-import pandas as pd
+import threading
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from utils.hand_parser import * 
+from utils.lru_cache import LRUCache, register_database_cache
 
 
 # Database connection helper
-def get_db_connection(db_path, timeout = 0):
+def get_db_connection(db_path, timeout = 5):
     """Establishes and returns a database connection."""
     conn = sqlite3.connect(db_path, timeout=timeout)
     conn.row_factory = lambda cursor, row: {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
@@ -22,67 +25,245 @@ def list_databases(db_directory):
 
 
 
+# Initial schema of the databases, it is then upgraded by MIGRATIONS
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hands (
+    id INTEGER PRIMARY KEY,
+    game_number TEXT,
+    site_name TEXT,
+    table_name TEXT,
+    date_time TEXT,
+    table_size INT,
+    number_players INT,
+    small_blind_amount DECIMAL,
+    big_blind_amount DECIMAL,
+    observed BOOLEAN,
+    hero_name TEXT, -- The hero name can change for example if user has different usernames in different platforms
+    hero_cards TEXT,
+    hero_hand_class TEXT,
+    hero_position TEXT,
+    hero_profit REAL,
+    flop BOOLEAN, -- if there was a flop or not
+    players TEXT, -- Players that participated in the hand (hero can be absent of the list if the hand is observed)
+    ohh_data TEXT  -- JSON blob to store the full ohh object
+);
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,
+    hands INTEGER, -- player hands
+    vpip REAL,
+    pfr REAL,
+    win_rate REAL,
+    af REAL -- Aggressive factor = (raises + bets) / calls
+    -- We will add more statistics later
+);
+CREATE TABLE IF NOT EXISTS players_hands (
+    player_id INTEGER,
+    hand_id INTEGER,
+    cards TEXT,
+    hand_class TEXT,
+    position INT,
+    position_name TEXT,
+    profit DECIMAL,
+    rake DECIMAL,
+    participed BOOLEAN,
+    vpip BOOLEAN,
+    pfr BOOLEAN,
+    aggressive INT,
+    passive INT,
+    two_bet_possibility BOOLEAN,
+    limp BOOLEAN,
+    two_bet BOOLEAN,
+    three_bet_possibility BOOLEAN,
+    three_bet BOOLEAN,
+    FOREIGN KEY (player_id) REFERENCES players(id)
+    FOREIGN KEY (hand_id) REFERENCES hands(id)
+PRIMARY KEY (player_id, hand_id)  -- Ensures each player can participate in each hand only once
+);
+"""
+
+# Schema changes applied to existing databases, in order. The number of applied migrations is stored in PRAGMA user_version.
+# Never modify a released migration, append a new one instead.
+MIGRATIONS = [
+    # 1: Remove duplicated hands and enforce the hand identity (site_name, table_name, game_number)
+    """
+    DELETE FROM players_hands WHERE hand_id IN (
+        SELECT id FROM hands WHERE id NOT IN (SELECT MIN(id) FROM hands GROUP BY site_name, table_name, game_number)
+    );
+    DELETE FROM hands WHERE id NOT IN (SELECT MIN(id) FROM hands GROUP BY site_name, table_name, game_number);
+    CREATE UNIQUE INDEX IF NOT EXISTS hands_identity ON hands (site_name, table_name, game_number);
+    """,
+    # 2: Move the OHH JSON out of the hands table so list and statistics queries don't page through it
+    """
+    CREATE TABLE IF NOT EXISTS hands_ohh (
+        hand_id INTEGER PRIMARY KEY,
+        ohh_data TEXT, -- JSON blob to store the full ohh object
+        FOREIGN KEY (hand_id) REFERENCES hands(id)
+    );
+    INSERT INTO hands_ohh (hand_id, ohh_data) SELECT id, ohh_data FROM hands;
+    -- ALTER TABLE DROP COLUMN keeps the old payload in the rows, the table needs to be rebuilt to become compact
+    CREATE TABLE hands_new (
+        id INTEGER PRIMARY KEY,
+        game_number TEXT,
+        site_name TEXT,
+        table_name TEXT,
+        date_time TEXT,
+        table_size INT,
+        number_players INT,
+        small_blind_amount DECIMAL,
+        big_blind_amount DECIMAL,
+        observed BOOLEAN,
+        hero_name TEXT,
+        hero_cards TEXT,
+        hero_hand_class TEXT,
+        hero_position TEXT,
+        hero_profit REAL,
+        flop BOOLEAN,
+        players TEXT
+    );
+    INSERT INTO hands_new SELECT id, game_number, site_name, table_name, date_time, table_size, number_players,
+                                 small_blind_amount, big_blind_amount, observed, hero_name, hero_cards,
+                                 hero_hand_class, hero_position, hero_profit, flop, players
+                          FROM hands;
+    DROP TABLE hands;
+    ALTER TABLE hands_new RENAME TO hands;
+    CREATE UNIQUE INDEX hands_identity ON hands (site_name, table_name, game_number);
+    """,
+    # 3: Background import jobs (see utils.import_jobs)
+    """
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT, -- queued, running, done or failed
+        files TEXT, -- JSON list of the paths of the files to import
+        files_total INT,
+        files_done INT DEFAULT 0,
+        hands_inserted INT DEFAULT 0,
+        hands_skipped INT DEFAULT 0, -- Hands already in the database or anonymous
+        created_at REAL, -- Unix timestamps
+        started_at REAL,
+        finished_at REAL,
+        error TEXT
+    );
+    """,
+    # 4: Folder imports, the manifest records how far each file of the imported folders has been ingested
+    """
+    ALTER TABLE import_jobs ADD COLUMN folder TEXT; -- Set for folder imports, the files of the folder are never removed
+    CREATE TABLE IF NOT EXISTS import_manifest (
+        path TEXT PRIMARY KEY,
+        size INT, -- Size and modification time of the file when it was last imported
+        mtime REAL,
+        offset INT, -- Number of bytes of the file already ingested
+        hash TEXT -- SHA-256 of these bytes, used to check that the file was only appended to
+    );
+    """,
+    # 5: Versioned re-derivation of players_hands (see full_update_players_hands)
+    """
+    ALTER TABLE hands ADD COLUMN parser_version INT DEFAULT 0; -- PARSER_VERSION that derived the players_hands rows of the hand, 0 if unknown
+    CREATE INDEX IF NOT EXISTS players_hands_hand ON players_hands (hand_id);
+    CREATE TABLE IF NOT EXISTS rederivation (
+        parser_version INT, -- Version being applied, the table has one row while a re-derivation is in progress
+        last_hand_id INT -- Hands up to this id are already in players_hands_shadow
+    );
+    """,
+    # 6: Running counters of the players statistics, updated with each imported batch (see add_players_statistics)
+    """
+    ALTER TABLE players ADD COLUMN participed_hands INT DEFAULT 0; -- Number of hands where the player took a decision
+    ALTER TABLE players ADD COLUMN vpip_hands INT DEFAULT 0;
+    ALTER TABLE players ADD COLUMN pfr_hands INT DEFAULT 0;
+    ALTER TABLE players ADD COLUMN aggressive_actions INT DEFAULT 0; -- Postflop bets and raises
+    ALTER TABLE players ADD COLUMN passive_actions INT DEFAULT 0; -- Postflop calls
+    ALTER TABLE players ADD COLUMN total_profit REAL DEFAULT 0;
+    ALTER TABLE players ADD COLUMN total_profit_bb REAL DEFAULT 0; -- Sum of the profits in big blinds of the hand
+    UPDATE players
+    SET hands = result.hands, participed_hands = result.participed, vpip_hands = result.vpip_hands, pfr_hands = result.pfr_hands,
+        aggressive_actions = result.aggressive, passive_actions = result.passive, total_profit = result.profit, total_profit_bb = result.profit_bb
+    FROM (SELECT ph.player_id, COUNT(*) AS hands, SUM(ph.participed) AS participed, SUM(ph.vpip) AS vpip_hands,
+                 SUM(ph.pfr) AS pfr_hands, SUM(ph.aggressive) AS aggressive, SUM(ph.passive) AS passive,
+                 SUM(ph.profit) AS profit, SUM(CAST(ph.profit AS REAL) / h.big_blind_amount) AS profit_bb
+          FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+          GROUP BY ph.player_id) AS result
+    WHERE players.id = result.player_id;
+    UPDATE players SET hands = 0 WHERE hands IS NULL;
+    UPDATE players
+    SET vpip = ROUND(CAST(vpip_hands AS FLOAT) / participed_hands * 100, 2),
+        pfr = ROUND(CAST(pfr_hands AS FLOAT) / participed_hands * 100, 2),
+        af = ROUND(CAST(aggressive_actions AS FLOAT) / passive_actions, 2),
+        win_rate = ROUND(total_profit_bb / hands, 2);
+    """,
+    # 7: Indexes of the list and statistics queries (checked by benchmarks/check_query_plans.py)
+    """
+    CREATE INDEX IF NOT EXISTS hands_date_time ON hands (date_time); -- Hands list, most recent first
+    CREATE INDEX IF NOT EXISTS players_ranking ON players (hands); -- Players list, ordered by number of hands
+    CREATE INDEX IF NOT EXISTS players_hands_player_profit ON players_hands (player_id, hand_id, profit); -- Covers the profit history of a player
+    """,
+    # 8: Search of the hands list: trigram full text index of the searched columns, hand classes prefixes for shorter searches
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS hands_search USING fts5(
+        players, table_name, hero_hand_class,
+        content = 'hands', content_rowid = 'id', -- The text is read from hands, only the index is stored
+        tokenize = 'trigram'
+    );
+    INSERT INTO hands_search (hands_search) VALUES ('rebuild');
+    CREATE INDEX IF NOT EXISTS hands_hand_class ON hands (hero_hand_class);
+    """,
+    # 9: Hand classes rollup of the opening ranges, one row per (player, position, players bucket, hand class) with known cards.
+    # players_bucket is the name of the STATISTICS_BUCKETS range of the number of players of the hand.
+    """
+    CREATE TABLE IF NOT EXISTS players_hand_classes (
+        player_id INTEGER NOT NULL,
+        position_name TEXT NOT NULL,
+        players_bucket TEXT NOT NULL,
+        hand_class TEXT NOT NULL,
+        dealt INTEGER NOT NULL DEFAULT 0,
+        vpip INTEGER NOT NULL DEFAULT 0,
+        pfr INTEGER NOT NULL DEFAULT 0,
+        limp INTEGER NOT NULL DEFAULT 0,
+        two_bet INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (player_id, position_name, players_bucket, hand_class)
+    ) WITHOUT ROWID;
+    INSERT INTO players_hand_classes (player_id, position_name, players_bucket, hand_class, dealt, vpip, pfr, limp, two_bet)
+    SELECT ph.player_id, ph.position_name,
+           CASE WHEN h.number_players BETWEEN 4 AND 6 THEN 'full' WHEN h.number_players BETWEEN 2 AND 3 THEN 'short' END AS bucket,
+           ph.hand_class, COUNT(*), SUM(ph.vpip), SUM(ph.pfr), SUM(ph.limp), SUM(ph.two_bet)
+    FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+    WHERE ph.hand_class IS NOT NULL AND ph.position_name IS NOT NULL
+    GROUP BY ph.player_id, ph.position_name, bucket, ph.hand_class
+    HAVING bucket IS NOT NULL;
+    """,
+    # 10: Table names prefixes for the short searches of the hands list (the players names prefixes use players.name)
+    """
+    CREATE INDEX IF NOT EXISTS hands_table_name ON hands (table_name);
+    """,
+]
+
+def migrate_db(db_path, target_version = None):
+    """Applies the pending MIGRATIONS (up to target_version, all by default) to the database, each one in its own transaction."""
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()["user_version"]
+        for number, script in enumerate(MIGRATIONS[version:target_version], start = version + 1):
+            cursor.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+            print(f"Database {os.path.basename(db_path)} migrated to version {number}.")
+        # Readers are not blocked by the import jobs writing in the background (persistent setting of the database file)
+        cursor.execute("PRAGMA journal_mode = WAL")
+
+def migrate_databases(db_directory):
+    """Upgrades every database of the directory to the last version of the schema, e.g. when the application starts."""
+    for db_name in list_databases(db_directory):
+        try:
+            migrate_db(os.path.join(db_directory, f"{db_name}.db"))
+        except sqlite3.Error as e:
+            print(f"Migration of database {db_name} failed:", e)
+
 def init_db(db_path):
     """Initializes the database with necessary tables."""
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
         try:
-            cursor.executescript("""
-            CREATE TABLE IF NOT EXISTS hands (
-                id INTEGER PRIMARY KEY,
-                game_number TEXT,
-                site_name TEXT,
-                table_name TEXT,
-                date_time TEXT,
-                table_size INT,
-                number_players INT,
-                small_blind_amount DECIMAL,
-                big_blind_amount DECIMAL,
-                observed BOOLEAN,
-                hero_name TEXT, -- The hero name can change for example if user has different usernames in different platforms
-                hero_cards TEXT,
-                hero_hand_class TEXT,
-                hero_position TEXT,
-                hero_profit REAL,
-                flop BOOLEAN, -- if there was a flop or not
-                players TEXT, -- Players that participated in the hand (hero can be absent of the list if the hand is observed)
-                ohh_data TEXT  -- JSON blob to store the full ohh object
-            );
-            CREATE TABLE IF NOT EXISTS players (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                hands INTEGER, -- player hands
-                vpip REAL,
-                pfr REAL,
-                win_rate REAL,
-                af REAL -- Aggressive factor = (raises + bets) / calls
-                -- We will add more statistics later
-            );
-            CREATE TABLE IF NOT EXISTS players_hands (
-                player_id INTEGER,
-                hand_id INTEGER,
-                cards TEXT,
-                hand_class TEXT,
-                position INT,
-                position_name TEXT,
-                profit DECIMAL,
-                rake DECIMAL,
-                participed BOOLEAN,
-                vpip BOOLEAN,
-                pfr BOOLEAN,
-                aggressive INT,
-                passive INT,
-                two_bet_possibility BOOLEAN,
-                limp BOOLEAN,
-                two_bet BOOLEAN,
-                three_bet_possibility BOOLEAN,
-                three_bet BOOLEAN,
-                FOREIGN KEY (player_id) REFERENCES players(id)
-                FOREIGN KEY (hand_id) REFERENCES hands(id)
-            PRIMARY KEY (player_id, hand_id)  -- Ensures each player can participate in each hand only once
-            );
-            """)
+            cursor.executescript(SCHEMA)
             conn.commit()
+            migrate_db(db_path)
             print("Database initialized successfully.")
 
             return 1
@@ -90,94 +271,325 @@ def init_db(db_path):
             print("Database initialization failed:", e)
             return 0
 
-def save_hands_bulk(hand_data_list, db_path):
+def prepare_hand(hand_data):
+    """Parses one hand for insertion. hand_data can be the OHH object or its JSON text.
+    Defined at module level so it can be executed by the worker processes of a parse executor."""
+    if isinstance(hand_data, str):
+        hand_data = json.loads(hand_data)
+    hands_data, players_hands_data = parse_hand_at_upload(hand_data)
+    hands_data["parser_version"] = PARSER_VERSION
+    if players_hands_data is not None:
+        hands_data["ohh_data"] = json.dumps(hand_data)
+    return hands_data, players_hands_data
+
+class ParseExecutor(ProcessPoolExecutor):
+    """Process pool parsing hands, which keeps its number of workers to split the work in chunks."""
+    def __init__(self, workers):
+        super().__init__(max_workers = workers)
+        self.workers = workers
+
+    def map_chunks(self, function, items):
+        """Like map, with about 4 chunks of items per worker so each worker gets several tasks of a few items."""
+        return self.map(function, items, chunksize = max(1, len(items) // (4 * self.workers)))
+
+def get_parse_executor(workers = 1):
+    """Returns a ParseExecutor used to parse hands in parallel, or None if parsing should stay in the current process.
+    workers = 0 uses one worker per CPU core."""
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    return ParseExecutor(workers)
+
+def parse_hands(hand_data_list, executor = None):
+    """Returns an iterator over prepare_hand results, in the same order as hand_data_list.
+    With an executor the hands are parsed by its worker processes and the work is submitted immediately."""
+    if executor is None:
+        return map(prepare_hand, hand_data_list)
+    return executor.map_chunks(prepare_hand, hand_data_list)
+
+def save_hands_bulk(hand_data_list, db_path, executor = None):
     """Inserts multiple hands and associated player data in a single transaction."""
-
-    hands_dics = []
-    players = set()
-    players_hands_dics = []
-
-    # Collect data for all hands and players in the batch
-    for hand_data in hand_data_list:
-        hands_data, players_hands_data = parse_hand_at_upload(hand_data)
+    return insert_parsed_hands(parse_hands(hand_data_list, executor), db_path)
+
+IDENTITY_COLUMNS = ("site_name", "table_name", "game_number")
+
+def hand_identity(hands_data):
+    """Returns the key identifying a hand across imports. It is unique in the hands table (hands_identity index).
+    Its values are converted to text like the TEXT columns store them, so that e.g. a numeric game_number matches the
+    value read back from the database. hand_row writes these same values."""
+    return tuple(None if hands_data[column] is None else str(hands_data[column]) for column in IDENTITY_COLUMNS)
+
+def get_existing_hand_identities(cursor, identities):
+    """Returns the identities (see hand_identity) of the given list already present in the hands table."""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS batch_hands (site_name TEXT, table_name TEXT, game_number TEXT)")
+    cursor.execute("DELETE FROM batch_hands")
+    cursor.executemany("INSERT INTO batch_hands VALUES (?, ?, ?)", identities)
+    cursor.execute("""
+    SELECT h.site_name, h.table_name, h.game_number
+    FROM batch_hands b
+    JOIN hands h ON h.site_name = b.site_name AND h.table_name = b.table_name AND h.game_number = b.game_number
+    """)
+    return [tuple(row) for row in cursor.fetchall()]
+
+# Columns written by the hands writer, in the order of the prepared statements
+HANDS_COLUMNS = ("id", "game_number", "site_name", "table_name", "date_time", "table_size", "number_players",
+                 "small_blind_amount", "big_blind_amount", "observed", "hero_name", "hero_cards", "hero_hand_class",
+                 "hero_position", "hero_profit", "flop", "players", "parser_version")
+PLAYERS_HANDS_COLUMNS = ("player_id", "hand_id", "cards", "hand_class", "position", "position_name", "profit", "rake",
+                         "participed", "vpip", "pfr", "aggressive", "passive", "two_bet_possibility", "limp", "two_bet",
+                         "three_bet_possibility", "three_bet")
+
+class PlayerIdCache:
+    """
+    Bounded in-process cache of player name -> player id, keyed by (database, name) in a LRUCache shared by the databases.
+    Ids of committed players never change, so the cache can be shared by concurrent requests on the same database.
+    Only committed ids must be added to it.
+    """
+    def __init__(self, max_size = 100000):
+        self.max_size = max_size # Maximum number of names cached, all databases together
+        self.lock = threading.Lock()
+        self.loaded = set() # Databases whose most recent players were loaded
+        self.ids = LRUCache(max_size) # (db_path, name) -> id
+
+    def _load(self, db_path):
+        # On first use of a database the cache is loaded with its most recent players
+        with self.lock:
+            if db_path in self.loaded:
+                return
+            with get_db_connection(db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, id FROM players ORDER BY id DESC LIMIT ?", (self.max_size,))
+                self.ids.update({(db_path, row["name"]): row["id"] for row in reversed(cursor.fetchall())})
+            self.loaded.add(db_path)
+
+    def get(self, db_path, names):
+        """Returns the name -> id dictionary of the cached names and the set of names that are not cached."""
+        self._load(db_path)
+        found = {}
+        missing = set()
+        for name in names:
+            player_id = self.ids.get((db_path, name))
+            if player_id is None:
+                missing.add(name)
+            else:
+                found[name] = player_id
+        return found, missing
+
+    def add(self, db_path, name_to_id):
+        """Adds committed name -> id pairs, evicting the least recently used names if needed."""
+        self._load(db_path)
+        self.ids.update({(db_path, name): player_id for name, player_id in name_to_id.items()})
+
+    def clear(self, db_path):
+        """Forgets the cache of a database, for example when it is deleted."""
+        with self.lock:
+            self.loaded.discard(db_path)
+            self.ids.clear(db_path)
+
+player_ids_cache = register_database_cache(PlayerIdCache(Config.PLAYER_ID_CACHE_SIZE))
+
+def data_version(cursor):
+    """Returns the data version of a database, which changes whenever hands are inserted or players_hands is re-derived.
+    Hands are only ever appended (ids increase) and never updated, so the largest id tells the inserts and is read from
+    the primary key. A re-derivation replaces players_hands by a new table, with a new root page."""
+    cursor.execute("""
+    SELECT (SELECT MAX(id) FROM hands) AS last_hand_id, (SELECT rootpage FROM sqlite_master WHERE name = 'players_hands') AS root_page
+    """)
+    row = cursor.fetchone()
+    return (row["last_hand_id"], row["root_page"])
+
+def resolve_player_ids(cursor, db_path, names):
+    """Returns the name -> id dictionary of the given player names, creating the unknown players.
+    Names missing from player_ids_cache are created with one bulk upsert and resolved with one set-based query.
+    Must be called inside the write transaction, the caller adds the result to player_ids_cache after the commit."""
+    name_to_id, missing = player_ids_cache.get(db_path, names)
+    if missing:
+        names_json = json.dumps(list(missing))
+        cursor.execute("INSERT INTO players (name) SELECT value FROM json_each(?) WHERE true ON CONFLICT (name) DO NOTHING", (names_json,))
+        cursor.execute("SELECT name, id FROM players WHERE name IN (SELECT value FROM json_each(?))", (names_json,))
+        name_to_id.update(cursor.fetchall())
+    return name_to_id
+
+def insert_statement(table, columns):
+    """Returns the prepared INSERT statement for the given table and columns."""
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+def hand_row(hand_id, hands_data):
+    """Returns the row of the hands table (ordered as HANDS_COLUMNS) for a hand returned by prepare_hand."""
+    identity = dict(zip(IDENTITY_COLUMNS, hand_identity(hands_data)))
+    return (hand_id,) + tuple(identity[column] if column in identity else hands_data.get(column) for column in HANDS_COLUMNS[1:])
+
+def players_hands_rows(hand_id, players_hands_data, name_to_id):
+    """Yields the rows of the players_hands table (ordered as PLAYERS_HANDS_COLUMNS) for a hand returned by prepare_hand."""
+    for name, data in players_hands_data.items():
+        yield (name_to_id[name], hand_id) + tuple(data[column] for column in PLAYERS_HANDS_COLUMNS[2:])
+
+def insert_parsed_hands(parsed_hands, db_path, before_commit = None):
+    """Inserts hands already processed by prepare_hand in a single transaction. Returns the number of inserted hands.
+    before_commit(cursor) is called inside the transaction, even if no hand is inserted, to save data atomically with the hands."""
+
+    # Collect data for all hands of the batch, hands repeated inside the batch are only kept once
+    batch = {}
+    for hands_data, players_hands_data in parsed_hands:
         if players_hands_data is None:
             continue  # Skip anonymous hands
-        
-        # Check if hand already exists in database, if it's the case, skip the hand
-        # TODO find a way to do it fast because it causes a lot of delay per file
-        #game_number = hands_data["game_number"]
-        #site_name = hands_data["game_number"]
-        #table_name = hands_data["table_name"]
-        #cursor.execute("SELECT id FROM hands WHERE game_number = ? AND site_name = ? AND table_name = ?", (game_number, site_name, table_name))
-        #if cursor.fetchone(): continue
-        
-        hands_data["ohh_data"] = json.dumps(hand_data)
-        hands_dics.append(hands_data)
-        players_hands_dics.append(players_hands_data)
-            
-        #Add players name to players set
-        for name in players_hands_data.keys(): players.add(name)
+        batch.setdefault(hand_identity(hands_data), (hands_data, players_hands_data))
 
-    if not players_hands_dics : # If the list is empty it means that all games are annonymous
-        return
+    if not batch and before_commit is None: # If the batch is empty it means that all games are annonymous
+        return 0
 
+    name_to_id = {}
     with sqlite3.connect(db_path) as conn:
         cursor = conn.cursor()
+        # Lock the database for writing so no other import can insert the same hands between the check and the insert
+        cursor.execute("BEGIN IMMEDIATE")
 
-        # Fetch the current max ID from the `hands` table directly
-        cursor.execute("SELECT MAX(id) FROM hands")
-        max_id = cursor.fetchone()[0] or 0  # Set to 0 if there are no rows
-
-        # Generate hands dataframe from list of dictionaries
-        hands_df = pd.DataFrame.from_dict(hands_dics)
-
-        # Insert hands dataframe into hands table
-        hands_df.to_sql(
-            name = 'hands',# Name of SQL table.
-            con = conn, # sqlalchemy.engine.Engine or sqlite3.Connection
-            if_exists='append', # How to behave if the table already exists. You can use 'replace', 'append' to replace it.
-            index=False, # It means index of DataFrame will save. Set False to ignore the index of DataFrame.
-            chunksize= 999 // (len(hands_df.columns)+1), # If DataFrame is big, this parameter is needed 
-            method="multi" # For inserting with executemany
-        )
-
-        # Calculate new hand IDs starting from max_id + 1
-        hand_ids = range(max_id + 1, max_id + 1 + len(hands_dics))
-
-        # Retrieve player_id or insert player and get id
-        name_to_id = {}
-        for name in players:
-            cursor.execute("SELECT id FROM players WHERE name = ?", (name,))
-            result = cursor.fetchone()
-            if result:
-                name_to_id[name] = result[0]  # Existing player ID
-            else:
-                cursor.execute("INSERT INTO players (name) VALUES (?)", (name,))
-                name_to_id[name] = cursor.lastrowid  # New player ID
-
-        # Prepare players_hands dataframe by using hands_ids and name_to_id
-        players_hands_df_list = []
-        for hand_id, players_hands in zip(hand_ids, players_hands_dics) : 
-            df = pd.DataFrame(data = players_hands).T.reset_index(names = 'player_id')
-            df['player_id'] = df['player_id'].apply(lambda name : name_to_id[name])
-            df["hand_id"] = hand_id
-            players_hands_df_list.append(df)
-
-        players_hands_df = pd.concat(players_hands_df_list, ignore_index=True)
-
-        # Insert players_hands dataframe into players_hands table
-        players_hands_df.to_sql(
-            name = 'players_hands',# Name of SQL table.
-            con = conn, # sqlalchemy.engine.Engine or sqlite3.Connection
-            if_exists='append', # How to behave if the table already exists. You can use 'replace', 'append' to replace it.
-            index=False, # It means index of DataFrame will save. Set False to ignore the index of DataFrame.
-            chunksize= 999 // (len(players_hands_df.columns)+1), # If DataFrame is big, this parameter is needed 
-            method="multi" # For inserting with executemany
-        )
+        # Skip the hands already in the database with a single query using the hands_identity index
+        if batch:
+            for identity in get_existing_hand_identities(cursor, batch.keys()):
+                del batch[identity]
+
+        if batch: # Not every hand of the batch was already in the database
+            name_to_id = write_hands(cursor, db_path, list(batch.values()))
+
+        if before_commit is not None:
+            before_commit(cursor)
 
         conn.commit()  # Single commit for the entire bulk
 
-    return
+    # Only cache ids once they are committed
+    player_ids_cache.add(db_path, name_to_id)
+
+    return len(batch)
+
+def write_hands(cursor, db_path, parsed_hands):
+    """Writes new hands (prepare_hand results) in the hands, hands_ohh, players and players_hands tables.
+    Must be called inside a write transaction. Returns the name -> id dictionary of the players of the hands."""
+    # Fetch the current max ID from the `hands` table directly, new hands get the following IDs
+    cursor.execute("SELECT MAX(id) FROM hands")
+    max_id = cursor.fetchone()[0] or 0  # Set to 0 if there are no rows
+    hands = list(enumerate(parsed_hands, start = max_id + 1))
+
+    cursor.executemany(insert_statement("hands", HANDS_COLUMNS),
+                       (hand_row(hand_id, hands_data) for hand_id, (hands_data, _) in hands))
+    cursor.executemany("INSERT INTO hands_ohh (hand_id, ohh_data) VALUES (?, ?)",
+                       ((hand_id, hands_data["ohh_data"]) for hand_id, (hands_data, _) in hands))
+    cursor.executemany("INSERT INTO hands_search (rowid, players, table_name, hero_hand_class) VALUES (?, ?, ?, ?)",
+                       ((hand_id, hands_data["players"], hands_data["table_name"], hands_data.get("hero_hand_class"))
+                        for hand_id, (hands_data, _) in hands))
+
+    # Retrieve player_id or insert player and get id
+    players = set()
+    for hands_data, players_hands_data in parsed_hands:
+        players.update(players_hands_data.keys())
+    name_to_id = resolve_player_ids(cursor, db_path, players)
+
+    cursor.executemany(insert_statement("players_hands", PLAYERS_HANDS_COLUMNS),
+                       (row for hand_id, (_, players_hands_data) in hands
+                            for row in players_hands_rows(hand_id, players_hands_data, name_to_id)))
+    add_players_statistics(cursor, parsed_hands, name_to_id)
+    return name_to_id
+
+# Running counters of the players table, in the order of the values returned by players_statistics_deltas
+PLAYERS_COUNTERS = ("hands", "participed_hands", "vpip_hands", "pfr_hands", "aggressive_actions", "passive_actions",
+                    "total_profit", "total_profit_bb")
+
+def players_statistics_deltas(parsed_hands):
+    """Returns the player name -> PLAYERS_COUNTERS increments of hands returned by prepare_hand."""
+    deltas = {}
+    for hands_data, players_hands_data in parsed_hands:
+        big_blind = float(hands_data["big_blind_amount"])
+        for name, data in players_hands_data.items():
+            profit = float(data["profit"])
+            delta = deltas.setdefault(name, [0] * len(PLAYERS_COUNTERS))
+            for index, value in enumerate((1, data["participed"], data["vpip"], data["pfr"], data["aggressive"],
+                                           data["passive"], profit, profit / big_blind)):
+                delta[index] += value
+    return deltas
+
+def add_players_statistics(cursor, parsed_hands, name_to_id):
+    """Adds the statistics of new hands to the counters of their players and updates their rates.
+    Must be called in the transaction that inserts the hands, so the counters always match players_hands."""
+    deltas = players_statistics_deltas(parsed_hands)
+    cursor.executemany(f"UPDATE players SET {', '.join(f'{counter} = COALESCE({counter}, 0) + ?' for counter in PLAYERS_COUNTERS)} WHERE id = ?",
+                       ((*delta, name_to_id[name]) for name, delta in deltas.items()))
+    update_players_rates(cursor, [name_to_id[name] for name in deltas])
+    add_players_hand_classes(cursor, parsed_hands, name_to_id)
+
+# Counters of the players_hand_classes rollup, summed from the players_hands columns of the same name except dealt
+HAND_CLASSES_COUNTERS = ("dealt", "vpip", "pfr", "limp", "two_bet")
+
+def players_bucket(number_players):
+    """Returns the name of the bucket of STATISTICS_BUCKETS holding number_players, or None."""
+    for name, (min_players, max_players) in STATISTICS_BUCKETS.items():
+        if min_players <= number_players <= max_players:
+            return name
+    return None
+
+def add_players_hand_classes(cursor, parsed_hands, name_to_id):
+    """Adds the hands with known cards to the players_hand_classes rollup. Must be called in the transaction that inserts the hands."""
+    deltas = {}
+    for hands_data, players_hands_data in parsed_hands:
+        bucket = players_bucket(hands_data["number_players"])
+        for name, data in players_hands_data.items():
+            if bucket is None or data["hand_class"] is None or data["position_name"] is None:
+                continue
+            delta = deltas.setdefault((name_to_id[name], data["position_name"], bucket, data["hand_class"]), [0] * len(HAND_CLASSES_COUNTERS))
+            for index, value in enumerate((1, data["vpip"], data["pfr"], data["limp"], data["two_bet"])):
+                delta[index] += value or 0
+    cursor.executemany(f"""
+    INSERT INTO players_hand_classes (player_id, position_name, players_bucket, hand_class, {', '.join(HAND_CLASSES_COUNTERS)})
+    VALUES ({', '.join('?' * (4 + len(HAND_CLASSES_COUNTERS)))})
+    ON CONFLICT (player_id, position_name, players_bucket, hand_class)
+    DO UPDATE SET {', '.join(f'{counter} = {counter} + excluded.{counter}' for counter in HAND_CLASSES_COUNTERS)}
+    """, ((*key, *delta) for key, delta in deltas.items()))
+
+def update_players_rates(cursor, player_ids = None):
+    """Computes the vpip, pfr, af and win_rate columns of the players (all of them if player_ids is None) from their counters."""
+    query = """
+    UPDATE players
+    SET vpip = ROUND(CAST(vpip_hands AS FLOAT) / participed_hands * 100, 2),
+        pfr = ROUND(CAST(pfr_hands AS FLOAT) / participed_hands * 100, 2),
+        af = ROUND(CAST(aggressive_actions AS FLOAT) / passive_actions, 2),
+        win_rate = ROUND(total_profit_bb / hands, 2)
+    """
+    if player_ids is None:
+        cursor.execute(query)
+    else:
+        cursor.execute(query + "WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(player_ids),))
+
+def save_hands_stream(hands, db_path, batch_size = 500, executor = None, on_batch = None, before_commit = None):
+    """Inserts hands coming from an iterator (e.g. utils.OHH.read_OHH) in fixed-size batches.
+    Each batch is committed on its own, so memory stays bounded and the first hands are queryable before the end of the stream.
+    With an executor (see get_parse_executor), the next batch is parsed by the workers while the current one is written,
+    the inserts stay in this process so they remain ordered and transactional.
+    on_batch(inserted, skipped) is called after each committed batch.
+    With before_commit, hands must yield (hand, checkpoint) pairs and before_commit(cursor, checkpoint) is called inside
+    the transaction of each batch with the checkpoint of its last hand (e.g. to save how far a file has been imported).
+    Returns the number of inserted hands."""
+    hands = iter(hands)
+    inserted = 0
+    pending = None # Parsed batch waiting to be written, its size and its checkpoint
+    while True:
+        batch = list(islice(hands, batch_size))
+        checkpoint = None
+        if before_commit is not None and batch:
+            checkpoint = batch[-1][1]
+            batch = [hand for hand, _ in batch]
+        parsed = parse_hands(batch, executor) if batch else None
+        if pending is not None:
+            commit_hook = None
+            if before_commit is not None:
+                commit_hook = lambda cursor, checkpoint = pending[2]: before_commit(cursor, checkpoint)
+            batch_inserted = insert_parsed_hands(pending[0], db_path, commit_hook)
+            inserted += batch_inserted
+            if on_batch is not None:
+                on_batch(batch_inserted, pending[1] - batch_inserted)
+        if parsed is None:
+            break
+        pending = (parsed, len(batch), checkpoint)
+    return inserted
 
 def load_hands_from_db(db_path):
     """Loads all hands from the database for display or analysis."""
@@ -233,29 +645,49 @@ def load_hands_from_db_old(db_path):
     return hands
 
 def update_players_statistics(db_path):
-    """Updates player statistics based on records in players_hands."""
-    with get_db_connection(db_path) as conn:
+    """Rebuilds the statistics of every player from players_hands. The imports keep them up to date (see add_players_statistics),
+    so this is only a maintenance action, e.g. if the counters were modified by hand."""
+    with sqlite3.connect(db_path, timeout = 5) as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-        UPDATE players
-        SET hands = result.hands,
-            vpip = result.VPIP,
-            pfr = result.PFR,
-            win_rate = result.bb_per_hand,
-            af = result.AF
-        FROM (SELECT player_id,
-                     COUNT(ph.hand_id) AS hands,
-                     ROUND(CAST(SUM(ph.vpip) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS VPIP,
-                     ROUND(CAST(SUM(ph.pfr) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS PFR,
-                     ROUND(CAST(SUM(ph.aggressive) AS FLOAT) / CAST(SUM(ph.passive) AS FLOAT),2) AS AF,
-                     ROUND(AVG(profit) / h.big_blind_amount,2) AS bb_per_hand
-              FROM players_hands ph JOIN hands h on ph.hand_id == h.id
-              GROUP BY player_id)
-        AS result
-        WHERE players.id = result.player_id
-        """)
+        cursor.execute("BEGIN IMMEDIATE")
+        rebuild_players_statistics(cursor)
         conn.commit()
 
+def rebuild_players_statistics(cursor):
+    """Recomputes the counters and rates of every player and the players_hand_classes rollup with a GROUP BY over players_hands.
+    Must be called in a write transaction."""
+    cursor.execute(f"UPDATE players SET {', '.join(f'{counter} = 0' for counter in PLAYERS_COUNTERS)}")
+    cursor.execute(f"""
+    UPDATE players
+    SET {', '.join(f'{counter} = result.{counter}' for counter in PLAYERS_COUNTERS)}
+    FROM (SELECT ph.player_id,
+                 COUNT(*) AS hands,
+                 SUM(ph.participed) AS participed_hands,
+                 SUM(ph.vpip) AS vpip_hands,
+                 SUM(ph.pfr) AS pfr_hands,
+                 SUM(ph.aggressive) AS aggressive_actions,
+                 SUM(ph.passive) AS passive_actions,
+                 SUM(ph.profit) AS total_profit,
+                 SUM(CAST(ph.profit AS REAL) / h.big_blind_amount) AS total_profit_bb
+          FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+          GROUP BY ph.player_id)
+    AS result
+    WHERE players.id = result.player_id
+    """)
+    update_players_rates(cursor)
+
+    bucket_case = " ".join("WHEN h.number_players BETWEEN ? AND ? THEN ?" for _ in STATISTICS_BUCKETS)
+    cursor.execute("DELETE FROM players_hand_classes")
+    cursor.execute(f"""
+    INSERT INTO players_hand_classes (player_id, position_name, players_bucket, hand_class, {', '.join(HAND_CLASSES_COUNTERS)})
+    SELECT ph.player_id, ph.position_name, CASE {bucket_case} END AS bucket, ph.hand_class,
+           COUNT(*), SUM(ph.vpip), SUM(ph.pfr), SUM(ph.limp), SUM(ph.two_bet)
+    FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+    WHERE ph.hand_class IS NOT NULL AND ph.position_name IS NOT NULL
+    GROUP BY ph.player_id, ph.position_name, bucket, ph.hand_class
+    HAVING bucket IS NOT NULL
+    """, [value for name, (min_players, max_players) in STATISTICS_BUCKETS.items() for value in (min_players, max_players, name)])
+
 def get_players_list(db_path):
     """Retrieves players from the database."""
     with get_db_connection(db_path) as conn:
@@ -264,115 +696,283 @@ def get_players_list(db_path):
         players = cursor.fetchall()
         return players
 
-def get_player_statistics_per_position(db_path, player_name, min_players=2, max_players=6):
-    """Retrieves statistics grouped by position for the given players from the database."""
-    with get_db_connection(db_path) as conn:
-        cursor = conn.cursor()
-        query = f"""
-        SELECT 
-        ph.position_name AS position,
-        COUNT(ph.hand_id) AS hands,
-        ROUND(CAST(SUM(ph.vpip) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS VPIP,
-        ROUND(CAST(SUM(ph.pfr) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS PFR,
-        ROUND(CAST(SUM(ph.aggressive) AS FLOAT) / CAST(SUM(ph.passive) AS FLOAT),2) AS AF,
-        ROUND(CAST(SUM(ph.two_bet) AS FLOAT) / CAST(SUM(ph.two_bet_possibility) AS FLOAT)*100,2) AS two_bet,
-        ROUND(CAST(SUM(ph.limp) AS FLOAT) / CAST(SUM(ph.two_bet_possibility) AS FLOAT)*100,2) AS limp,
-        ROUND(CAST(SUM(ph.three_bet) AS FLOAT) / CAST(SUM(ph.three_bet_possibility) AS FLOAT)*100,2) AS three_bet,
-        ROUND(AVG(profit) / h.big_blind_amount,2) AS bb_per_hand
-        FROM players_hands ph JOIN hands h ON h.id == ph.hand_id JOIN players p ON p.id == ph.player_id
-        WHERE p.name == "{player_name}" AND h.number_players >= {min_players} AND  h.number_players <= {max_players} 
-        GROUP BY position_name 
-        ORDER BY MAX(ph.position) DESC
-        """
-        cursor.execute(query)
-        player_stats = cursor.fetchall()
-        return player_stats
-
-
-def get_player_full_statistics(db_path, player_name, min_players=2, max_players=6):
-    """Retrieves statistics grouped by position for the given players from the database."""
+# Player count ranges of the statistics page, name -> (min_players, max_players). They must not overlap.
+# They are also the players buckets of the players_hand_classes rollup, rebuild the statistics after changing them.
+STATISTICS_BUCKETS = {"full": (4, 6), "short": (2, 3)}
+
+# Sums computed for each (bucket, position) group of a player's hands by get_player_statistics
+STATISTICS_SUMS = {
+    "hands": "COUNT(*)",
+    "participed": "SUM(ph.participed)",
+    "vpip": "SUM(ph.vpip)",
+    "pfr": "SUM(ph.pfr)",
+    "aggressive": "SUM(ph.aggressive)",
+    "passive": "SUM(ph.passive)",
+    "two_bet": "SUM(ph.two_bet)",
+    "limp": "SUM(ph.limp)",
+    "two_bet_possibility": "SUM(ph.two_bet_possibility)",
+    "three_bet": "SUM(ph.three_bet)",
+    "three_bet_possibility": "SUM(ph.three_bet_possibility)",
+    "won": "SUM(CASE WHEN ph.profit > 0 THEN ph.profit ELSE 0 END)",
+    "lost": "SUM(CASE WHEN ph.profit < 0 THEN ph.profit ELSE 0 END)",
+    "rake": "SUM(ph.rake)",
+    "profit": "SUM(ph.profit)",
+    "profit_bb": "SUM(CAST(ph.profit AS REAL) / h.big_blind_amount)",
+    "rake_bb": "SUM(CAST(ph.rake AS REAL) / h.big_blind_amount)",
+}
+
+def ratio(numerator, denominator, factor = 1):
+    """Returns round(numerator / denominator * factor, 2), or None if the denominator is 0 (as the SQL division)."""
+    if not denominator or numerator is None:
+        return None
+    return round(float(numerator) / float(denominator) * factor, 2)
+
+# Ratios shared by the statistics of the database and of the stats engine, name -> (numerator, denominator, factor).
+# The numerators and denominators are names of STATISTICS_SUMS.
+RATIO_STATISTICS = {
+    "VPIP": ("vpip", "participed", 100),
+    "PFR": ("pfr", "participed", 100),
+    "AF": ("aggressive", "passive", 1),
+    "two_bet": ("two_bet", "two_bet_possibility", 100),
+    "limp": ("limp", "two_bet_possibility", 100),
+    "three_bet": ("three_bet", "three_bet_possibility", 100),
+    "bb_per_hand": ("profit_bb", "hands", 1),
+}
+
+def ratio_statistics(sums):
+    """Returns the RATIO_STATISTICS of a group of hands from its sums."""
+    return {name: ratio(sums[numerator], sums[denominator], factor) for name, (numerator, denominator, factor) in RATIO_STATISTICS.items()}
+
+def statistics_from_sums(sums):
+    """Returns the statistics displayed for a group of hands from its STATISTICS_SUMS."""
+    return {
+        "hands": sums["hands"],
+        **ratio_statistics(sums),
+        "total_won": round(sums["won"] + sums["rake"], 2),
+        "total_lost": round(sums["lost"], 2),
+        "total_rake": round(sums["rake"], 2),
+        "profit": round(sums["profit"], 2),
+        "rake_bb_per_100hand": ratio(sums["rake_bb"], sums["hands"], 100),
+    }
+
+def get_player_statistics(db_path, player_name, buckets = STATISTICS_BUCKETS):
+    """Returns all the statistics of the player page with a single pass over the player's hands:
+    for each bucket of buckets (see STATISTICS_BUCKETS), {"positions": statistics per position, "total": statistics of the bucket}.
+    Positions are ordered from the button to the small blind."""
+    bucket_case = " ".join("WHEN h.number_players BETWEEN ? AND ? THEN ?" for _ in buckets)
+    bucket_parameters = [value for name, (min_players, max_players) in buckets.items() for value in (min_players, max_players, name)]
+    query = f"""
+    SELECT CASE {bucket_case} END AS bucket,
+           ph.position_name AS position,
+           MAX(ph.position) AS position_order,
+           {', '.join(f'{expression} AS {name}' for name, expression in STATISTICS_SUMS.items())}
+    FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+    WHERE ph.player_id = (SELECT id FROM players WHERE name = ?)
+    GROUP BY bucket, ph.position_name
+    HAVING bucket IS NOT NULL
+    ORDER BY bucket, position_order DESC
+    """
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        query = f"""
-        SELECT 
-        COUNT(ph.hand_id) AS hands,
-        ROUND(CAST(SUM(ph.vpip) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS VPIP,
-        ROUND(CAST(SUM(ph.pfr) AS FLOAT) / CAST(SUM(ph.participed) AS FLOAT)*100,2) AS PFR,
-        ROUND(CAST(SUM(ph.aggressive) AS FLOAT) / CAST(SUM(ph.passive) AS FLOAT),2) AS AF,
-        ROUND(CAST(SUM(ph.two_bet) AS FLOAT) / CAST(SUM(ph.two_bet_possibility) AS FLOAT)*100,2) AS two_bet,
-        ROUND(CAST(SUM(ph.limp) AS FLOAT) / CAST(SUM(ph.two_bet_possibility) AS FLOAT)*100,2) AS limp,
-        ROUND(CAST(SUM(ph.three_bet) AS FLOAT) / CAST(SUM(ph.three_bet_possibility) AS FLOAT)*100,2) AS three_bet,
-        ROUND(SUM(CASE WHEN profit > 0 THEN profit ELSE 0 END) + SUM(rake), 2) AS total_won,
-        ROUND(SUM(CASE WHEN profit < 0 THEN profit ELSE 0 END),2) AS total_lost,
-        ROUND(SUM(rake),2) AS total_rake,
-        ROUND(SUM(profit),2) AS profit,
-        ROUND(AVG(rake)/h.big_blind_amount*100,2) AS rake_bb_per_100hand,
-        ROUND(AVG(profit)/h.big_blind_amount,2) AS bb_per_hand
-        FROM players_hands ph JOIN hands h ON h.id == ph.hand_id JOIN players p ON p.id == ph.player_id
-        WHERE p.name == "{player_name}" AND h.number_players >= {min_players} AND  h.number_players <= {max_players} 
-        """
-        cursor.execute(query)
-        player_stats = cursor.fetchone()
-
-        return player_stats
-
-
-
-def get_player_profit_historique(player_name, db_path):
+        cursor.execute(query, (*bucket_parameters, player_name))
+        groups = cursor.fetchall()
+
+    statistics = {}
+    for name in buckets:
+        rows = [row for row in groups if row["bucket"] == name]
+        totals = {key: sum(row[key] or 0 for row in rows) for key in STATISTICS_SUMS}
+        statistics[name] = {
+            "positions": [dict(statistics_from_sums(row), position = row["position"]) for row in rows],
+            "total": statistics_from_sums(totals),
+        }
+    return statistics
+
+def get_player_hand_classes(db_path, player_name, position = None, buckets = None):
+    """Returns hand_class -> {HAND_CLASSES_COUNTERS} of the hands of a player with known cards, read from the
+    players_hand_classes rollup (at most 169 rows per position and bucket).
+    :param position: Position name (SB, BB, MP, HJ, CO, BU), all positions if None
+    :param buckets: Names of STATISTICS_BUCKETS, all buckets if None
+    """
+    conditions = ""
+    parameters = [player_name]
+    if position:
+        conditions += " AND position_name = ?"
+        parameters.append(position)
+    if buckets:
+        conditions += " AND players_bucket IN (SELECT value FROM json_each(?))"
+        parameters.append(json.dumps(list(buckets)))
+    query = f"""
+    SELECT hand_class, {', '.join(f'SUM({counter}) AS {counter}' for counter in HAND_CLASSES_COUNTERS)}
+    FROM players_hand_classes
+    WHERE player_id = (SELECT id FROM players WHERE name = ?){conditions}
+    GROUP BY hand_class
+    """
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        query = """
-        SELECT h.date_time AS date_time,
-               ph.profit AS profit 
-        FROM players p
-        JOIN players_hands ph ON p.id = ph.player_id
+        cursor.execute(query, parameters)
+        return {row.pop("hand_class"): row for row in cursor.fetchall()}
+
+def get_player_profit_historique(player_name, db_path, buckets = None, window_size = 1, date_from = None, date_to = None):
+    """
+    Returns the cumulative profit of a player after each of his hands, in (date_time, id) order, as dictionaries with
+    hand_number (from 1), date_time, profit_cum and profit_cum_smooth (rolling mean of profit_cum over window_size hands).
+    The running sums are computed by SQLite with window functions.
+    :param buckets: If given, the hands are split in this many buckets of consecutive hands and only the hands with the
+                    lowest and the highest profit_cum_smooth of each bucket are returned (min/max downsampling), which
+                    keeps the shape of the curve with at most 2 * buckets + 2 points: the first and the last hands are
+                    always returned, so the curve ends at the final profit. Use the width in pixels of the plot.
+    :param date_from, date_to: Range of dates ("YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS"), both included. The cumulative
+                               profit starts at the first hand of the range.
+    """
+    conditions = ""
+    parameters = [player_name]
+    if date_from:
+        conditions += " AND h.date_time >= ?"
+        parameters.append(date_from)
+    if date_to:
+        conditions += " AND h.date_time <= ?"
+        parameters.append(date_to + " 23:59:59" if len(date_to) == 10 else date_to) # A date alone includes its whole day
+    parameters.append(max(int(window_size), 1) - 1)
+
+    query = f"""
+    WITH cumulative AS MATERIALIZED (
+        SELECT ROW_NUMBER() OVER hands_order AS hand_number,
+               h.date_time AS date_time,
+               SUM(ph.profit) OVER hands_order AS profit_cum
+        FROM players_hands ph
         JOIN hands h ON ph.hand_id = h.id
-        WHERE p.name == ?
+        WHERE ph.player_id = (SELECT id FROM players WHERE name = ?){conditions}
+        WINDOW hands_order AS (ORDER BY h.date_time, h.id ROWS UNBOUNDED PRECEDING)
+    ),
+    smoothed AS MATERIALIZED (
+        SELECT hand_number, date_time, profit_cum,
+               AVG(profit_cum) OVER (ORDER BY hand_number ROWS BETWEEN ? PRECEDING AND CURRENT ROW) AS profit_cum_smooth
+        FROM cumulative
+    )
+    """
+    if buckets:
+        # With a single MIN or MAX aggregate, SQLite takes the other columns from the row holding the minimum or maximum
+        query += """
+        SELECT hand_number, date_time, profit_cum, MIN(profit_cum_smooth) AS profit_cum_smooth
+        FROM smoothed GROUP BY (hand_number - 1) * ? / (SELECT COUNT(*) FROM cumulative)
+        UNION
+        SELECT hand_number, date_time, profit_cum, MAX(profit_cum_smooth) AS profit_cum_smooth
+        FROM smoothed GROUP BY (hand_number - 1) * ? / (SELECT COUNT(*) FROM cumulative)
+        UNION
+        SELECT hand_number, date_time, profit_cum, profit_cum_smooth
+        FROM smoothed WHERE hand_number IN (1, (SELECT COUNT(*) FROM cumulative))
+        ORDER BY hand_number
         """
-        cursor.execute(query, (player_name,))
-        result = cursor.fetchall()
-        return result
+        parameters += [int(buckets)] * 2
+    else:
+        query += "SELECT hand_number, date_time, profit_cum, profit_cum_smooth FROM smoothed ORDER BY hand_number"
 
-def full_update_players_hands(db_path):
-    """Fully updates players_hands table by reparsing all hands. Use this if you update parse_hand_at_upload function with modified or new statistics. All players should already be in the players table."""
     with get_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT id, ohh_data FROM hands")
-        hands = cursor.fetchall()
-
-        cursor.execute("SELECT id, name FROM players")
-        players = cursor.fetchall()
-
-        # We can't update a table directly with df.to_sql() and by replacing it we loose the types information. For simplicity and generality we will remove the old table, recreate one empty with init_db and append to the table with to_sql().
-        cursor.execute("DROP TABLE players_hands")
-
-        conn.commit()
-
-    init_db(db_path) # Recreates players_hands table
-
-    name_to_id = {player["name"]:player["id"] for player in players}
-    
-    players_hands_df_list = []
-    for hand in hands:
-        ohh = json.loads(hand["ohh_data"])
-        hands_data, players_hands_data = parse_hand_at_upload(ohh)
-        df = pd.DataFrame(data = players_hands_data).T.reset_index(names = 'player_id')
-        df['player_id'] = df['player_id'].apply(lambda name : name_to_id[name])
-        df["hand_id"] = hand["id"]
-        players_hands_df_list.append(df)
-
-    players_hands_df = pd.concat(players_hands_df_list, ignore_index=True)
-
-    with sqlite3.connect(db_path) as conn:
-
-        players_hands_df.to_sql(
-            name = 'players_hands',# Name of SQL table.
-            con = conn, # sqlalchemy.engine.Engine or sqlite3.Connection
-            if_exists='append', # How to behave if the table already exists. You can use 'replace', 'append' to replace it.
-            index=False, # It means index of DataFrame will save. Set False to ignore the index of DataFrame.
-            chunksize= 999 // (len(players_hands_df.columns)+1), # If DataFrame is big, this parameter is needed 
-            method="multi", # For inserting with executemany
-            dtype=None, # Set the columns type of sql table. Usefull when creating the table
-        )
-        conn.commit()
-    
+        cursor.execute(query, parameters)
+        return cursor.fetchall()
+
+def derive_players_hands(ohh_data):
+    """Returns the players_hands data of a hand from its OHH JSON text.
+    Defined at module level so it can be executed by the worker processes of a parse executor."""
+    return parse_hand_at_upload(json.loads(ohh_data))[1]
+
+def full_update_players_hands(db_path, chunk_size = None, workers = None):
+    """Re-derives the players_hands rows of the hands parsed by a version of parse_hand_at_upload older than PARSER_VERSION.
+    Use this if you update parse_hand_at_upload function with modified or new statistics (and increment PARSER_VERSION).
+
+    The new rows are written in players_hands_shadow by chunks of hands in id order, parsed by a parse executor with
+    workers processes (Config.PARSE_WORKERS by default). Each chunk is committed with a checkpoint in the rederivation
+    table, so an interrupted run resumes after the last committed chunk. Once every hand is done, the shadow table
+    replaces players_hands in a single transaction, so players_hands stays complete and usable during the whole run.
+    Returns the number of re-derived hands."""
+    chunk_size = chunk_size or Config.UPLOAD_BATCH_SIZE
+    executor = get_parse_executor(Config.PARSE_WORKERS if workers is None else workers)
+    derived_hands = 0
+    try:
+        with sqlite3.connect(db_path, timeout = 5) as conn:
+            cursor = conn.cursor()
+            last_hand_id = start_rederivation(cursor)
+            if last_hand_id is None:
+                return 0
+
+            while True:
+                cursor.execute("""
+                SELECT h.id, h.parser_version, o.ohh_data FROM hands h LEFT JOIN hands_ohh o ON o.hand_id = h.id
+                WHERE h.id > ? ORDER BY h.id LIMIT ?
+                """, (last_hand_id, chunk_size))
+                chunk = cursor.fetchall()
+                if not chunk:
+                    break
+
+                # Parse the outdated hands before locking the database, the rows of the other hands are copied as they are
+                outdated = [(hand_id, ohh_data) for hand_id, version, ohh_data in chunk if version < PARSER_VERSION and ohh_data is not None]
+                up_to_date = [hand_id for hand_id, version, ohh_data in chunk if version >= PARSER_VERSION or ohh_data is None]
+                ohh_list = [ohh_data for _, ohh_data in outdated]
+                if executor is None:
+                    derived = list(map(derive_players_hands, ohh_list))
+                else:
+                    derived = list(executor.map_chunks(derive_players_hands, ohh_list))
+                last_hand_id = chunk[-1][0]
+
+                cursor.execute("BEGIN IMMEDIATE")
+                name_to_id = resolve_player_ids(cursor, db_path, {name for players_hands_data in derived for name in players_hands_data})
+                cursor.execute("INSERT INTO players_hands_shadow SELECT * FROM players_hands WHERE hand_id IN (SELECT value FROM json_each(?))",
+                               (json.dumps(up_to_date),))
+                cursor.executemany(insert_statement("players_hands_shadow", PLAYERS_HANDS_COLUMNS),
+                                   (row for (hand_id, _), players_hands_data in zip(outdated, derived)
+                                        for row in players_hands_rows(hand_id, players_hands_data, name_to_id)))
+                cursor.execute("UPDATE rederivation SET last_hand_id = ?", (last_hand_id,))
+                conn.commit()
+                player_ids_cache.add(db_path, name_to_id)
+                derived_hands += len(outdated)
+
+            swap_players_hands(cursor, last_hand_id)
+            conn.commit()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"Database {os.path.basename(db_path)}: players_hands re-derived for {derived_hands} hands (parser version {PARSER_VERSION}).")
+    return derived_hands
+
+def start_rederivation(cursor):
+    """Returns the id of the last hand already written in players_hands_shadow, creating the shadow table if no
+    re-derivation to PARSER_VERSION is in progress. Returns None if every hand is up to date."""
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT parser_version, last_hand_id FROM rederivation")
+    state = cursor.fetchone()
+    if state is not None and state[0] == PARSER_VERSION:
+        cursor.execute("COMMIT")
+        return state[1]
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM hands WHERE parser_version < ?)", (PARSER_VERSION,))
+    if not cursor.fetchone()[0]:
+        cursor.execute("COMMIT")
+        return None
+
+    # The shadow table is created from the current definition of players_hands, whatever the migrations made of it
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'players_hands'")
+    shadow_sql = cursor.fetchone()[0].replace("players_hands", "players_hands_shadow", 1)
+    cursor.execute("DROP TABLE IF EXISTS players_hands_shadow")
+    cursor.execute(shadow_sql)
+    cursor.execute("DELETE FROM rederivation")
+    cursor.execute("INSERT INTO rederivation (parser_version, last_hand_id) VALUES (?, 0)", (PARSER_VERSION,))
+    cursor.execute("COMMIT")
+    return 0
+
+def swap_players_hands(cursor, last_hand_id):
+    """Replaces players_hands by players_hands_shadow, must be called once every hand up to last_hand_id is in the shadow table.
+    The caller commits, the whole swap is a single transaction."""
+    cursor.execute("BEGIN IMMEDIATE")
+    # Hands imported after the last chunk was read were parsed by the current version
+    cursor.execute("INSERT INTO players_hands_shadow SELECT * FROM players_hands WHERE hand_id > ?", (last_hand_id,))
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'players_hands' AND sql IS NOT NULL")
+    indexes = [sql for sql, in cursor.fetchall()]
+    cursor.execute("DROP TABLE players_hands")
+    cursor.execute("ALTER TABLE players_hands_shadow RENAME TO players_hands")
+    for sql in indexes:
+        cursor.execute(sql)
+    cursor.execute("UPDATE hands SET parser_version = ? WHERE parser_version < ?", (PARSER_VERSION, PARSER_VERSION))
+    cursor.execute("DELETE FROM rederivation")
+    rebuild_players_statistics(cursor)
@@ -73,3 +73,125 @@ document.addEventListener('DOMContentLoaded', function() {
 document.body.addEventListener('htmx:afterSwap', function(event) {
   attachRowHandlers();
 });
+
+// Replay of the displayed hand, embedded in the replayer page and stepped through in the browser
+let replay = null;
+
+function loadReplay() {
+  const element = document.getElementById('replay-timeline');
+  if (!element) {
+    replay = null;
+    return;
+  }
+  const timeline = JSON.parse(element.textContent);
+  replay = {states: timelineStates(timeline), index: Number(document.getElementById('replay').dataset.state)};
+}
+
+// Same as timeline_states in utils/hand_parser.py: every game state is built from the previous one
+function timelineStates(timeline) {
+  const states = [];
+  let state = timeline.initial;
+  for (const delta of timeline.deltas) {
+    state = Object.assign({}, state, {players: state.players.map(player => Object.assign({}, player))});
+    for (const [field, value] of Object.entries(delta)) {
+      if (field === 'players') {
+        for (const [index, fields] of value) {
+          Object.assign(state.players[index], fields);
+        }
+      } else {
+        state[field] = value;
+      }
+    }
+    states.push(state);
+  }
+  states[states.length - 1].final_pots = timeline.final_pots;
+  return states;
+}
+
+function escapeHtml(text) {
+  const div = document.createElement('div');
+  div.textContent = text;
+  return div.innerHTML;
+}
+
+// Numbers are displayed as by the templates (Python floats rounded to 2 decimals)
+function formatNumber(value) {
+  const rounded = Math.round(value * 100) / 100;
+  return Number.isInteger(rounded) ? rounded.toFixed(1) : String(rounded);
+}
+
+function cardImage(card, className) {
+  return `<img class="${className}" src="../static/images/cards/${card}.png" alt="Card">`;
+}
+
+// Renders a game state like poker_table.html and hand_replayer.html
+function renderState(state) {
+  let table = '';
+  for (const player of state.players) {
+    table += `
+    <div class="player" style="left: calc(50% + ( 50% * ${Math.cos(-player.angle)} )); top: calc(50% - ( 50% * ${Math.sin(-player.angle)} ));">
+        <div class="player-box"></div>
+        <div class="player-name">${escapeHtml(player.name)}</div>
+        <div class="player-stack">${formatNumber(player.chips)} BB</div>
+        <div class="player-cards">${player.cards.map(card => cardImage(card, 'cards')).join('')}</div>
+    </div>`;
+    if (player.dealer) {
+      table += `
+    <div class="dealer-button" style="left: calc(50% + ( 32% * ${Math.cos(-player.angle + 0.2)} )); top: calc(45% - ( 32% * ${Math.sin(-player.angle + 0.2)} ));">D</div>`;
+    }
+    if (player.bet > 0) {
+      table += `
+    <div class="playerBet" style="left: calc(50% + ( 32% * ${Math.cos(-player.angle)} )); top: calc(45% - ( 32% * ${Math.sin(-player.angle)} ));">${formatNumber(player.bet)}</div>`;
+    }
+  }
+  table += `
+    <div class="community-cards">${state.board_cards.map(card => cardImage(card, 'card')).join('')}</div>
+    <div class="pot">Pot: ${formatNumber(state.pot)} BB</div>`;
+  document.querySelector('#replay .game-container').innerHTML = table;
+  document.getElementById('street').textContent = `Street : ${state.street}`;
+  document.getElementById('action').textContent = state.action;
+
+  let pots = '';
+  if (state.final_pots && state.final_pots.length) {
+    pots = '<div class="box"><h3>Final Pot(s)</h3>';
+    for (const pot of state.final_pots) {
+      pots += `<div>Total Pot: ${formatNumber(pot.amount)} | Rake: ${formatNumber(pot.rake)}</div>
+    <table class="pot-table" style="width:50%;">
+        <thead><tr><th>Winner</th><th>Win Amount</th><th>Rake</th><th>Cashout Fee</th><th>Cashout Amount</th></tr></thead>
+        ${pot.player_wins.map(win => `<tr><td>${escapeHtml(win.name)}</td><td>${formatNumber(win.win_amount)}</td>
+        <td>${formatNumber(win.contributed_rake)}</td><td>${formatNumber(win.cashout_fee)}</td><td>${formatNumber(win.cashout_amount)}</td></tr>`).join('')}
+    </table>`;
+    }
+    pots += '</div>';
+  }
+  document.getElementById('final-pots').innerHTML = pots;
+}
+
+function stepReplay(step) {
+  const last = replay.states.length - 1;
+  const index = {beginning: 0, previous: replay.index - 1, next: replay.index + 1, end: last}[step];
+  replay.index = Math.min(Math.max(index, 0), last);
+  document.getElementById('replay').dataset.state = replay.index;
+  renderState(replay.states[replay.index]);
+}
+
+// The navigation buttons request the server only if the replay is not loaded
+document.body.addEventListener('htmx:beforeRequest', function(event) {
+  const step = event.detail.elt.dataset.step;
+  if (step && replay) {
+    event.preventDefault();
+    stepReplay(step);
+  }
+});
+
+document.body.addEventListener('htmx:afterSwap', function(event) {
+  loadReplay();
+  // Follows in the hands list the hand opened by the previous and next hand buttons
+  const element = document.getElementById('replay');
+  if (event.detail.target.id === 'hand-replayer-container' && element) {
+    const row = document.querySelector(`tr[data-hand-id="${element.dataset.handId}"]`);
+    if (row && row !== selectedRow) {
+      setSelectedRow(row);
+    }
+  }
+});
@@ -25,6 +25,41 @@ possible_actions = [
             "Add to Pot",  #This can be a player or non-player action.  Can be used when the site adds money/chips to the pot to stimulate action, for example.
 ]
 
+def read_OHH(stream, raw = False, offset = None):
+    """
+    Incrementally read an OHH stream and yield one hand (parsed JSON) at a time.
+
+    Hands are separated by an empty line, so only the hand being read is kept in memory.
+    :param stream: Binary or text file-like object (an open file, an uploaded file stream, ...)
+    :param raw: Yield the JSON text of each hand instead of parsing it (used when parsing is done by worker processes)
+    :param offset: Position of the stream in bytes (binary streams only). If given, (hand, offset) pairs are yielded where
+                   offset is the position right after the hand, and a last hand not followed by an empty line is only
+                   yielded if it is complete, as the file may still be being written.
+    """
+    lines = []
+    for line in stream:
+        if offset is not None:
+            offset += len(line)
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig")
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            text = "".join(lines)
+            hand = text if raw else json.loads(text)
+            yield hand if offset is None else (hand, offset)
+            lines = []
+    if lines:
+        text = "".join(lines)
+        if offset is None:
+            yield text if raw else json.loads(text)
+            return
+        try:
+            hand = json.loads(text)
+        except json.JSONDecodeError:
+            return # Incomplete hand, it will be read once the file is complete
+        yield (text if raw else hand, offset)
+
 def cards_string_to_list(string): #When cards are given as "AcKs" for example
     if len(string)%2 == 1 :
         raise ValueError("Invalid length of string")
@@ -53,7 +88,7 @@ class Action:
                    "action": self.action_type,
                  }
         if float(self.amount) > 0 : output["amount"] = self.amount
-        if self.is_all_in : output["is_allin"]: True
+        if self.is_all_in : output["is_allin"] = True
         if self.cards is not None: output["cards"] = self.cards
 
         return output
@@ -107,6 +142,7 @@ class Player:
 
     def winnings_to_json(self) -> dict:
         return {
+            "player_id": self.player_id,
 	    "win_amount": self.win_amount,
 	    "cashout_amount": self.cashout_amount,
 	    "cashout_fee": self.cashout_fee,
@@ -144,7 +180,7 @@ class Pot:
                 "amount": self.amount,
                 "rake": self.rake,
                 "jackpot": self.jackpot,
-                "players_wins": [player_.winnings_to_json() for player_ in self.players]}
+                "player_wins": [player_.winnings_to_json() for player_ in self.players]}
     
 
 class Hand:
@@ -194,6 +230,7 @@ class Hand:
                     "start_date_utc": self.start_date_utc,
                     "table_name": self.table_name,
                     "table_size": self.table_size,
+                    "dealer_seat": self.dealer_seat,
                     "game_type" : self.game_type,
                     "hero_player_id": self.hero_player_id,
                     "small_blind_amount" : self.small_blind_amount,
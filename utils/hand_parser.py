@@ -1,8 +1,14 @@
 from collections import defaultdict
-import numpy as np
 from datetime import datetime
+from math import pi
 from utils.cards_utils import cardsToClass, getCardSymbol, cardsListToString
 
+# Version of parse_hand_at_upload, stored with each hand. Increment it when the players_hands data it returns changes,
+# models.full_update_players_hands then re-derives the hands parsed by older versions.
+PARSER_VERSION = 1
+
+# Number of game states between two full states (checkpoints) of a replay timeline, see get_replay_timeline
+TIMELINE_CHECKPOINT_INTERVAL = 16
 
 def parse_hand_at_upload(ohh_obj):
     #Extract general info necessary for hand insertion in table
@@ -130,10 +136,10 @@ def parse_hand_at_upload(ohh_obj):
     for name in game_participation:
         seats_list.append(player_seat[name])
     # We get a position from 0 to 6
-    position_list = (np.array(seats_list) - dealer_seat -1)% table_size
-    # We transform the position from 0 to 6 to 0 to number_players. 0 is SB and the highest is BU
-    real_position_list = np.argsort(np.argsort(position_list))
-    seat_to_position = {seat:int(real_position_list[i]) for i, seat in enumerate(seats_list) }
+    position_list = [(seat - dealer_seat -1)% table_size for seat in seats_list]
+    # We transform the position from 0 to 6 to 0 to number_players (its rank). 0 is SB and the highest is BU
+    ranked_seats = sorted(range(len(seats_list)), key = position_list.__getitem__)
+    seat_to_position = {seats_list[i]: rank for rank, i in enumerate(ranked_seats)}
 
     position_to_name = {
         (0,2):"SB", (1,2):"BB",
@@ -200,6 +206,23 @@ def parse_hand_at_upload(ohh_obj):
     return hands_data, players_hands_data
 
 def get_data_for_replayer(hand_data, amount_in_BB = True):
+    """Returns the general data of a hand and the list of all its game states (see get_replay_timeline)."""
+    timeline = get_replay_timeline(hand_data, amount_in_BB)
+    if not timeline:
+        return {}
+    return timeline["general_data"], timeline_states(timeline)
+
+def get_replay_timeline(hand_data, amount_in_BB = True, checkpoint_interval = TIMELINE_CHECKPOINT_INTERVAL):
+    """
+    Returns the replay of a hand as a timeline, a compact form of its game states that can be sent as JSON:
+     - general_data: table name and blinds
+     - initial: state before the first action (not displayed)
+     - deltas: one dictionary per game state with the fields changed since the previous state ("players" is a list of
+       [player index, changed fields of the player]), the first one applies to initial
+     - checkpoints: full game state every checkpoint_interval states (states 0, checkpoint_interval, ...)
+     - final_pots: pots and winners, shown in the last game state
+    A game state is rebuilt by timeline_state from its checkpoint and at most checkpoint_interval - 1 deltas.
+    """
     if "ohh" not in hand_data:
         print("Error", "Invalid hand data format. Missing 'ohh' key")
         return {}
@@ -209,10 +232,7 @@ def get_data_for_replayer(hand_data, amount_in_BB = True):
     # Map player IDs to names for easy reference
 
     players = {player["id"]: player for player in ohh_data["players"]}
-    name_to_seat = {player["name"]:player["seat"] for player in ohh_data["players"]}
     hero_id = ohh_data.get("hero_player_id", None) 
-    observed = True if hero_id is None else False
-    hero_cards = ""
 
     hero_seat = players.get(hero_id, 0)["seat"]
 
@@ -222,7 +242,8 @@ def get_data_for_replayer(hand_data, amount_in_BB = True):
         "big_blind_amount": float(ohh_data["big_blind_amount"]),
     }
 
-    action_snapshot = {
+    # Current game state, modified in place through set_value and set_player which record the changes of the next delta
+    state = {
         "players": [],
         "pot" : 0.00,
         "action": "",
@@ -241,59 +262,73 @@ def get_data_for_replayer(hand_data, amount_in_BB = True):
             "chips": float(player["starting_stack"])/general_data["big_blind_amount"] if amount_in_BB else float(player["starting_stack"]),
             "bet" : 0.00,
             "dealer": player["seat"] == ohh_data["dealer_seat"],
-            "angle": np.pi* (2*(player["seat"]-hero_seat)/len(ohh_data["players"]) + 1/2)
+            "angle": pi* (2*(player["seat"]-hero_seat)/len(ohh_data["players"]) + 1/2)
             }
-        action_snapshot["players"].append(player_info)
+        state["players"].append(player_info)
         id_to_index[player['id']] = index 
 
-    game_states = []
-    need_to_deal_cards = False
-    action_amount = 0
+    timeline = {
+        "general_data": general_data,
+        "initial": copy_state(state),
+        "deltas": [],
+        "checkpoint_interval": checkpoint_interval,
+        "checkpoints": [],
+        "final_pots": None,
+    }
+    changes = {}
+    players_changes = {}
+
+    def set_value(field, value):
+        state[field] = value
+        changes[field] = value
+
+    def set_player(index, field, value):
+        state["players"][index][field] = value
+        players_changes.setdefault(index, {})[field] = value
+
+    def add_state():
+        # Lists are replaced, never modified in place, so the deltas and the checkpoints can share them
+        delta = dict(changes)
+        if players_changes:
+            delta["players"] = [[index, fields] for index, fields in sorted(players_changes.items())]
+        changes.clear()
+        players_changes.clear()
+        timeline["deltas"].append(delta)
+        if (len(timeline["deltas"]) - 1) % checkpoint_interval == 0:
+            timeline["checkpoints"].append(copy_state(state))
 
-    states_to_pop = []
+    need_to_deal_cards = False
 
     for round_info in ohh_data["rounds"]:
 
         # If the street changes
-        if action_snapshot["street"] != round_info["street"]:
+        if state["street"] != round_info["street"]:
             # Change the name of the street
-            action_snapshot["street"] = round_info["street"]
-            # For each player
-            for player in action_snapshot["players"]:
-                # Reset its bet to 0 
-                player["bet"] = 0
+            set_value("street", round_info["street"])
+            # For each player, reset its bet to 0 
+            for index in range(len(state["players"])):
+                set_player(index, "bet", 0)
 
             # Add cards to the board
             if "cards" in round_info:
-                action_snapshot["board_cards"] += round_info["cards"] 
-                action_snapshot["action"] = "New card(s)"
+                set_value("board_cards", state["board_cards"] + round_info["cards"])
+                set_value("action", "New card(s)")
 
-            if action_snapshot["street"] != "Showdown" :
-                game_states.append(action_snapshot)
-
-            #Copy action_snapshot for next action
-            players = []
-            for player in action_snapshot["players"]:
-                players.append(player.copy())
-            board_cards = action_snapshot["board_cards"].copy()
-            action_snapshot = action_snapshot.copy()
-            action_snapshot["players"] = players
-            action_snapshot["board_cards"] = board_cards
+            if state["street"] != "Showdown" :
+                add_state()
 
         # For each action
         for action in round_info["actions"]:
 
-            if action["action"] in ["Post BB", "Post SB", "Post Extra Blind"]:
-                states_to_pop.append(len(game_states))
-
-            player = action_snapshot["players"][id_to_index[action.get("player_id")]]
+            index = id_to_index[action.get("player_id")]
+            player = state["players"][index]
             action_amount = float(action.get('amount',0))
             if amount_in_BB : action_amount = action_amount / general_data["big_blind_amount"]
 
             # If need to dealt cards, give back cards to every player:
             if need_to_deal_cards:
-                for pl in action_snapshot["players"]:
-                    pl["cards"] = ['back', 'back']
+                for other in range(len(state["players"])):
+                    set_player(other, "cards", ['back', 'back'])
                 need_to_deal_cards = False
 
             # If big blind is posted, need to deal cards
@@ -301,52 +336,37 @@ def get_data_for_replayer(hand_data, amount_in_BB = True):
 
             # If cards in action, add it to the player (given to Hero or showed)
             if action.get("cards"):
-                player["cards"] = action["cards"]
+                set_player(index, "cards", action["cards"])
 
             # If player folds, remove its cards
             if action['action'] == "Fold":
-                player["cards"] = []
+                set_player(index, "cards", [])
 
             # Generate a description for the action
             if action_amount == 0:
-                action_snapshot["action"] = f"{player['name']}: {action['action']}"
+                set_value("action", f"{player['name']}: {action['action']}")
             else :
-                action_snapshot["action"] = f"{player['name']}: {action['action']} for {action_amount}"
+                set_value("action", f"{player['name']}: {action['action']} for {action_amount}")
 
             # Update bet, chip amount and pot
-            player["bet"] += action_amount
-            player["chips"] -= action_amount
-            action_snapshot["pot"] += action_amount
-
-            game_states.append(action_snapshot)
-
-            #Copy action_snapshot for next action
-            players = []
-            for player in action_snapshot["players"]:
-                players.append(player.copy())
-            board_cards = action_snapshot["board_cards"].copy()
-            action_snapshot = action_snapshot.copy()
-            action_snapshot["players"] = players
-            action_snapshot["board_cards"] = board_cards
-
-            action_amount = 0
-            action_snapshot["action"] = ""
-
-    # Check the firsts actions and remove the undesired ones
-    popped = 0
-    for index in states_to_pop: 
-        game_states.pop(index-popped)
-        popped +=1
+            set_player(index, "bet", player["bet"] + action_amount)
+            set_player(index, "chips", player["chips"] - action_amount)
+            set_value("pot", state["pot"] + action_amount)
 
-    
-    # Include pot and winnings information at the last state
-    game_states[-1]["final_pots"] = [
+            # The blinds are not displayed, their changes go to the next game state
+            if action["action"] not in ["Post BB", "Post SB", "Post Extra Blind"]:
+                add_state()
+
+            set_value("action", "")
+
+    # Pot and winnings information, included at the last state
+    timeline["final_pots"] = [
         {
             "rake": float(pot["rake"]),
             "amount": float(pot["amount"]),
             "player_wins": [
                 {
-                    "name": action_snapshot["players"][id_to_index[win.get("player_id")]]["name"],
+                    "name": state["players"][id_to_index[win.get("player_id")]]["name"],
                     "win_amount": float(win["win_amount"]),
                     "contributed_rake":float(win["contributed_rake"]),
                     "cashout_fee": float(win.get("cashout_fee", 0.00)),
@@ -358,4 +378,39 @@ def get_data_for_replayer(hand_data, amount_in_BB = True):
         for pot in ohh_data["pots"]
     ]
 
-    return general_data, game_states
+    return timeline
+
+def copy_state(state):
+    """Returns a copy of a game state that can be modified without changing state (its lists are never modified in place)."""
+    return dict(state, players = [player.copy() for player in state["players"]])
+
+def apply_delta(state, delta):
+    """Applies a delta of a timeline to a game state, in place."""
+    for field, value in delta.items():
+        if field == "players":
+            for player_index, fields in value:
+                state["players"][player_index].update(fields)
+        else:
+            state[field] = value
+
+def timeline_states(timeline):
+    """Returns the list of all the game states of a timeline, each one built from the previous one."""
+    states = []
+    state = timeline["initial"]
+    for delta in timeline["deltas"]:
+        state = copy_state(state)
+        apply_delta(state, delta)
+        states.append(state)
+    states[-1]["final_pots"] = timeline["final_pots"]
+    return states
+
+def timeline_state(timeline, index):
+    """Returns the game state number index (from 0) of a timeline (see get_replay_timeline)."""
+    interval = timeline["checkpoint_interval"]
+    checkpoint = index // interval
+    state = copy_state(timeline["checkpoints"][checkpoint])
+    for delta in timeline["deltas"][checkpoint * interval + 1:index + 1]:
+        apply_delta(state, delta)
+    if index == len(timeline["deltas"]) - 1:
+        state["final_pots"] = timeline["final_pots"]
+    return state
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from config import Config
+import models
+from utils.OHH import read_OHH
+from utils.replay_store import replay_store
+
+# Import jobs are stored in the import_jobs table of their database, so their progress survives page reloads.
+# They are executed one at a time by a single worker thread, which keeps the inserts ordered.
+# Besides the statuses listed in the import_jobs table, a job can be "cancelled" (see cancel_import_jobs).
+jobs_queue = queue.Queue()
+queued_jobs = set() # (db_path, job_id) of the jobs waiting in jobs_queue or running
+cancelled_jobs = set() # (db_path, job_id) of the queued jobs cancelled by cancel_import_jobs, skipped by the worker
+running_job = None # (db_path, job_id) of the job being executed
+worker_lock = threading.Lock()
+worker = None
+
+
+class ImportCancelled(Exception):
+    """Raised in the worker thread to stop a running job cancelled by cancel_import_jobs."""
+
+
+def submit_import_job(db_path, files = (), folder = None):
+    """Creates an import job and queues it. Returns the job id.
+    The job imports either files (paths on disk, they are deleted once imported) or all the .OHH files of a folder,
+    incrementally thanks to the import manifest (see import_folder)."""
+    job_id = uuid.uuid4().hex
+    files = list(files)
+    with models.get_db_connection(db_path) as conn:
+        conn.execute("INSERT INTO import_jobs (id, status, files, files_total, folder, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                     (job_id, json.dumps(files), len(files), folder, time.time()))
+        conn.commit()
+    queue_job(db_path, job_id)
+    return job_id
+
+def resume_import_jobs(db_path):
+    """Queues again the unfinished jobs of a database, for example the ones interrupted by a restart of the server."""
+    with models.get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM import_jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+        for job in cursor.fetchall():
+            queue_job(db_path, job["id"])
+
+def queue_job(db_path, job_id):
+    """Adds a job to the queue, starting the worker thread if needed."""
+    global worker
+    with worker_lock:
+        if (db_path, job_id) in queued_jobs:
+            return
+        queued_jobs.add((db_path, job_id))
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(target = worker_loop, name = "import-jobs", daemon = True)
+            worker.start()
+    jobs_queue.put((db_path, job_id))
+
+def worker_loop():
+    global running_job
+    while True:
+        db_path, job_id = jobs_queue.get()
+        with worker_lock:
+            cancelled = (db_path, job_id) in cancelled_jobs
+            cancelled_jobs.discard((db_path, job_id))
+            running_job = None if cancelled else (db_path, job_id)
+        try:
+            if cancelled:
+                continue
+            # sqlite3.connect would create an empty database in place of a deleted one
+            if not os.path.exists(db_path):
+                print(f"Import job {job_id} skipped: database {db_path} not found.")
+                continue
+            run_import_job(db_path, job_id)
+        except ImportCancelled:
+            print(f"Import job {job_id} cancelled.")
+        except Exception as e:
+            print(f"Import job {job_id} failed:", e)
+            # The failure is recorded if possible, an error here must not stop the worker
+            try:
+                update_import_job(db_path, job_id, status = "failed", finished_at = time.time(), error = str(e))
+            except Exception as e:
+                print(f"Import job {job_id}: failure not recorded:", e)
+        finally:
+            with worker_lock:
+                queued_jobs.discard((db_path, job_id))
+                cancelled_jobs.discard((db_path, job_id))
+                running_job = None
+
+def cancel_import_jobs(db_path, timeout = 30):
+    """Cancels the queued and running jobs of a database, for example before deleting it, and removes their uploaded files.
+    The running job stops after its current batch, this waits for it (at most timeout seconds). Returns the number of jobs cancelled."""
+    with worker_lock:
+        jobs = {job for job in queued_jobs if job[0] == db_path}
+        cancelled_jobs.update(jobs)
+    files = []
+    if os.path.exists(db_path):
+        with models.get_db_connection(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT files FROM import_jobs WHERE status IN ('queued', 'running')")
+            files = [path for job in cursor.fetchall() for path in json.loads(job["files"] or "[]")]
+            cursor.execute("UPDATE import_jobs SET status = 'cancelled', finished_at = ? WHERE status IN ('queued', 'running')",
+                           (time.time(),))
+            conn.commit()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with worker_lock:
+            if running_job is None or running_job[0] != db_path:
+                break
+        time.sleep(0.05)
+    for path in files:
+        if os.path.exists(path):
+            os.remove(path)
+    return len(jobs)
+
+def run_import_job(db_path, job_id):
+    """Imports the files of a job, starting after the files already done. Progress is saved after each committed batch."""
+    job = get_import_job(db_path, job_id)
+    if job is None or job["status"] not in ("queued", "running"):
+        return
+    update_import_job(db_path, job_id, status = "running", started_at = job["started_at"] or time.time())
+
+    def on_batch(inserted, skipped):
+        add_import_progress(db_path, job_id, hands_inserted = inserted, hands_skipped = skipped)
+        with worker_lock:
+            if (db_path, job_id) in cancelled_jobs:
+                cancelled_jobs.discard((db_path, job_id))
+                raise ImportCancelled()
+
+    executor = models.get_parse_executor(Config.PARSE_WORKERS)
+    try:
+        if job["folder"]:
+            import_folder(db_path, job, executor, on_batch)
+        else:
+            import_files(db_path, job, executor, on_batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    update_import_job(db_path, job_id, status = "done", finished_at = time.time())
+
+    # The most recent hands are the first ones of the hands list, their replays are built before they are opened
+    if Config.REPLAY_WARM_UP_HANDS > 0:
+        try:
+            replay_store.warm_up(db_path, Config.REPLAY_WARM_UP_HANDS)
+        except Exception as e:
+            print(f"Warm-up of the replays of job {job_id} failed:", e)
+
+def import_files(db_path, job, executor, on_batch):
+    """Imports the uploaded files of a job not done yet and removes them."""
+    files = json.loads(job["files"])
+    for path in files[job["files_done"]:]:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                hands = read_OHH(f, raw = executor is not None)
+                models.save_hands_stream(hands, db_path, Config.UPLOAD_BATCH_SIZE, executor, on_batch)
+            os.remove(path)
+        else:
+            print(f"Import job {job['id']}: file {path} not found, skipped.")
+        add_import_progress(db_path, job["id"], files_done = 1)
+
+    # Remove the upload directories left empty
+    for directory in {os.path.dirname(path) for path in files}:
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+def import_folder(db_path, job, executor, on_batch):
+    """Imports the .OHH files of a folder (and its subfolders) using the import manifest of the database:
+    unchanged files are skipped without being read and files that were appended to are imported from their last offset."""
+    paths = sorted(str(path) for path in Path(job["folder"]).rglob("*.OHH"))
+    update_import_job(db_path, job["id"], files_total = len(paths), files_done = 0)
+
+    with models.get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM import_manifest")
+        manifest = {entry["path"]: entry for entry in cursor.fetchall()}
+
+    for path in paths:
+        import_file_incrementally(db_path, path, manifest.get(path), executor, on_batch)
+        add_import_progress(db_path, job["id"], files_done = 1)
+
+def import_file_incrementally(db_path, path, entry, executor, on_batch):
+    """Imports the hands of a file after the offset recorded in its manifest entry (None if the file is new).
+    The manifest entry is updated in the transaction of each batch, so an interrupted import restarts after the last committed batch."""
+    stat = os.stat(path)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime and entry["offset"] >= stat.st_size:
+        return # Unchanged since its last import
+
+    hasher = hashlib.sha256()
+    offset = 0
+    with open(path, "rb") as f:
+        # Resume after the ingested bytes if they did not change (the file was only appended to), else import the whole file again
+        if entry is not None and entry["offset"] <= stat.st_size:
+            remaining = entry["offset"]
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+            if hasher.hexdigest() == entry["hash"]:
+                offset = entry["offset"]
+            else:
+                hasher = hashlib.sha256()
+                f.seek(0)
+
+        def lines():
+            for line in f:
+                hasher.update(line)
+                yield line
+
+        # Each hand comes with the checkpoint (offset, hash of the bytes before the offset) of the position after it
+        def hands():
+            for hand, end in read_OHH(lines(), raw = executor is not None, offset = offset):
+                yield hand, (end, hasher.hexdigest())
+
+        def save_checkpoint(cursor, checkpoint):
+            cursor.execute("""
+            INSERT INTO import_manifest (path, size, mtime, offset, hash) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, offset = excluded.offset, hash = excluded.hash
+            """, (path, stat.st_size, stat.st_mtime, *checkpoint))
+
+        models.save_hands_stream(hands(), db_path, Config.UPLOAD_BATCH_SIZE, executor, on_batch, save_checkpoint)
+
+def update_import_job(db_path, job_id, **values):
+    with models.get_db_connection(db_path) as conn:
+        conn.execute(f"UPDATE import_jobs SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                     (*values.values(), job_id))
+        conn.commit()
+
+def add_import_progress(db_path, job_id, files_done = 0, hands_inserted = 0, hands_skipped = 0):
+    with models.get_db_connection(db_path) as conn:
+        conn.execute("""
+        UPDATE import_jobs
+        SET files_done = files_done + ?, hands_inserted = hands_inserted + ?, hands_skipped = hands_skipped + ?
+        WHERE id = ?
+        """, (files_done, hands_inserted, hands_skipped, job_id))
+        conn.commit()
+
+def get_import_job(db_path, job_id = None):
+    """Returns the job with the given id (the most recent one if job_id is None) and its throughput in hands/sec, or None."""
+    if not os.path.exists(db_path):
+        return None # The database was deleted (sqlite3.connect would create it again)
+    with models.get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        if job_id is None:
+            cursor.execute("SELECT * FROM import_jobs ORDER BY created_at DESC LIMIT 1")
+        else:
+            cursor.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,))
+        job = cursor.fetchone()
+
+    if job is not None:
+        elapsed = (job["finished_at"] or time.time()) - job["started_at"] if job["started_at"] else 0
+        job["throughput"] = round((job["hands_inserted"] + job["hands_skipped"]) / elapsed) if elapsed > 0 else 0
+    return job
@@ -0,0 +1,75 @@
+"""
+Bounded in-process caches shared by the requests (see LRUCache), and the hook forgetting what they hold of a database.
+
+The caches of database data register themselves with register_database_cache, so deleting a database only needs
+forget_database(db_path).
+"""
+import threading
+from collections import OrderedDict
+
+database_caches = [] # Objects with a clear(db_path) method, cleared by forget_database
+
+
+def register_database_cache(cache):
+    """Registers a cache (any object with a clear(db_path) method) to be cleared by forget_database. Returns the cache."""
+    database_caches.append(cache)
+    return cache
+
+def forget_database(db_path):
+    """Forgets the data of a database in all the registered caches, for example when it is deleted."""
+    for cache in database_caches:
+        cache.clear(db_path)
+
+
+class LRUCache:
+    """
+    Thread-safe cache evicting the least recently used values once their total size goes over max_size.
+    The size of a value is size(value), 1 by default so max_size is then a number of values (e.g. len for bytes).
+    Keys are tuples starting with the path of the database the value comes from, so clear(db_path) forgets a database.
+    """
+    def __init__(self, max_size, size = None):
+        self.max_size = max_size
+        self.size_of = size or (lambda value: 1)
+        self.size = 0 # Total size of the cached values
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (value, size), least recently used first
+
+    def get(self, key, default = None):
+        """Returns the value of a key, or default if it is not cached."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def add(self, key, value):
+        """Caches a value, evicting the least recently used ones if needed. Returns the value."""
+        self.update({key: value})
+        return value
+
+    def update(self, items):
+        """Caches the values of a key -> value dictionary at once."""
+        sized = [(key, value, self.size_of(value)) for key, value in items.items()] # Sizes computed outside the lock
+        with self.lock:
+            for key, value, size in sized:
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)[1]
+                self.entries[key] = (value, size)
+                self.size += size
+            while self.size > self.max_size and self.entries:
+                self.size -= self.entries.popitem(last = False)[1][1]
+
+    def keys(self):
+        """Returns the list of the cached keys."""
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self, db_path):
+        """Forgets the values of a database, for example when it is deleted."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == db_path]:
+                self.size -= self.entries.pop(key)[1]
+
+    def __len__(self):
+        return len(self.entries)
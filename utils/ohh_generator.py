@@ -0,0 +1,203 @@
+"""
+Seeded generator of synthetic No Limit Hold'em hands, built with the classes of utils.OHH.
+
+The hands are valid OHH hands that can be imported and replayed: every player is dealt cards, the players fold, call,
+bet and raise at random, the chips are consistent from the blinds to the final stacks and a single pot is raked once
+there is a flop. There is no hand evaluation, the winner of a showdown is drawn at random.
+The same seed and options always produce the same hands, so the generator is used by the benchmarks.
+
+Usage: python -m utils.ohh_generator output_dir [--hands 1000] [--seed 0] [--table-sizes 6] [--pool-size 100]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from utils.OHH import Action, Round, Player, Pot, Hand, Session
+
+CENT = Decimal("0.01")
+DECK = [rank + suit for rank in "23456789TJQKA" for suit in "cdhs"]
+DEFAULT_BLINDS = ((Decimal("0.05"), Decimal("0.10")), (Decimal("0.25"), Decimal("0.50")), (Decimal("1"), Decimal("2")))
+
+
+class HandGenerator:
+    def __init__(self, seed = 0, table_sizes = (6,), pool_size = 100, blinds = DEFAULT_BLINDS, site_name = "Synthetic",
+                 hero_name = "Hero", start_date = datetime(2024, 1, 1), first_game_number = 1):
+        """
+        :param seed: Seed of the random generator
+        :param table_sizes: Table sizes to draw from, between 2 and 6 (the positions of the parser stop at 6 players)
+        :param pool_size: Number of opponents the players of each hand are drawn from
+        :param blinds: (small blind, big blind) stakes to draw from
+        :param hero_name: Name of the hero, who plays every hand
+        """
+        if not table_sizes or min(table_sizes) < 2 or max(table_sizes) > 6:
+            raise ValueError("Table sizes must be between 2 and 6")
+        if pool_size < max(table_sizes) - 1:
+            raise ValueError("The player pool is smaller than the tables")
+
+        self.rng = random.Random(seed)
+        self.table_sizes = list(table_sizes)
+        self.blinds = [(Decimal(sb), Decimal(bb)) for sb, bb in blinds]
+        self.hero_name = hero_name
+        self.pool = [f"Player{number}" for number in range(1, pool_size + 1)]
+        self.session = Session(f"synthetic_{seed}", site_name = site_name, network_name = site_name, internal_version = "1")
+        self.clock = start_date
+        self.game_number = first_game_number - 1
+
+    def hand(self) -> Hand:
+        """Returns the next hand."""
+        rng = self.rng
+        self.game_number += 1
+        self.clock += timedelta(seconds = rng.randint(20, 120))
+        table_size = rng.choice(self.table_sizes)
+        sb, bb = rng.choice(self.blinds)
+        number_players = rng.randint(2, table_size)
+
+        hand = Hand()
+        hand.game_number = str(self.game_number)
+        hand.start_date_utc = self.clock.strftime("%Y-%m-%dT%H:%M:%SZ")
+        hand.table_name = f"{table_size}max {sb}/{bb} #{rng.randint(1, 3)}"
+        hand.table_size = table_size
+        hand.small_blind_amount = sb
+        hand.big_blind_amount = bb
+        hand.ante_amount = Decimal(0)
+        hand.hero_player_id = 0
+
+        seats = rng.sample(range(1, table_size + 1), number_players)
+        names = [self.hero_name] + rng.sample(self.pool, number_players - 1)
+        stacks = [bb * rng.randint(40, 200) for _ in range(number_players)]
+        players = [Player(player_id, names[player_id], stacks[player_id], None, seats[player_id]) for player_id in range(number_players)]
+        for player_ in players: hand.add_player(player_)
+        hand.dealer_seat = rng.choice(seats)
+
+        # Players ordered from the small blind to the button, as the positions of the parser
+        order = sorted(range(number_players), key = lambda player_id: (seats[player_id] - hand.dealer_seat - 1) % table_size)
+        deck = rng.sample(DECK, 2 * number_players + 5)
+        cards = {player_id: [deck.pop(), deck.pop()] for player_id in order}
+
+        state = {"stacks": stacks, "invested": [Decimal(0)] * number_players, "live": set(order), "bb": bb}
+
+        preflop = Round(0, "Preflop")
+        bets = {player_id: Decimal(0) for player_id in order}
+        for player_id, action_type, amount in ((order[0], "Post SB", sb), (order[1], "Post BB", bb)):
+            self.add_action(preflop, player_id, action_type, state, bets, amount)
+        for player_id in order:
+            action = self.add_action(preflop, player_id, "Dealt Cards", state, bets)
+            if player_id == hand.hero_player_id:
+                action.add_cards(cards[player_id])
+        self.betting_round(preflop, order[2:] + order[:2], state, bets, bb)
+        hand.add_round(preflop)
+
+        flop = False
+        for round_id, (street, number_cards) in enumerate((("Flop", 3), ("Turn", 1), ("River", 1)), start = 1):
+            if len(state["live"]) < 2:
+                break
+            flop = True
+            round_ = Round(round_id, street)
+            round_.set_community_cards([deck.pop() for _ in range(number_cards)])
+            self.betting_round(round_, order, state, {player_id: Decimal(0) for player_id in order}, Decimal(0))
+            hand.add_round(round_)
+
+        live = [player_id for player_id in order if player_id in state["live"]]
+        if len(live) > 1:
+            showdown = Round(len(hand.rounds), "Showdown")
+            for player_id in live:
+                self.add_action(showdown, player_id, "Shows Cards", state).add_cards(cards[player_id])
+            hand.add_round(showdown)
+
+        amount = sum(state["invested"])
+        rake = min((amount * Decimal("0.05")).quantize(CENT), 3 * bb) if flop else Decimal(0)
+        winner = players[rng.choice(live)]
+        winner.add_winnings(amount - rake, cashout_amount = amount - rake, contributed_rake = rake)
+        pot = Pot(0, amount, rake)
+        pot.add_player(winner)
+        hand.add_pot(pot)
+
+        for player_ in players:
+            player_.final_stack = state["stacks"][player_.player_id]
+        winner.final_stack += amount - rake
+
+        self.session.add_hand(hand)
+        return hand
+
+    def add_action(self, round_, player_id, action_type, state, bets = None, amount = Decimal(0)):
+        """Adds an action to the round and moves its amount from the stack of the player to the pot."""
+        state["stacks"][player_id] -= amount
+        state["invested"][player_id] += amount
+        if bets is not None:
+            bets[player_id] += amount
+        action = Action(len(round_.actions), player_id, action_type, amount, is_all_in = amount > 0 and state["stacks"][player_id] == 0)
+        round_.add_action(action)
+        return action
+
+    def betting_round(self, round_, acting_order, state, bets, level):
+        """Plays a betting round at random. No bet goes over what every live player can pay, so there is a single pot."""
+        rng = self.rng
+        live = state["live"]
+        need_to_act = [player_id for player_id in acting_order if player_id in live]
+        acting_order = list(need_to_act)
+        raises = 0
+        index = 0
+        while need_to_act and len(live) > 1:
+            player_id = acting_order[index % len(acting_order)]
+            index += 1
+            if player_id not in need_to_act or player_id not in live:
+                continue
+            need_to_act.remove(player_id)
+
+            cap = min(state["stacks"][other] + bets[other] for other in live)
+            can_raise = level < cap and raises < 4
+            to_call = level - bets[player_id]
+            draw = rng.random()
+            if to_call > 0 and draw < 0.45:
+                self.add_action(round_, player_id, "Fold", state)
+                live.discard(player_id)
+            elif to_call > 0 and (draw < 0.9 or not can_raise):
+                self.add_action(round_, player_id, "Call", state, bets, to_call)
+            elif to_call == 0 and (draw < 0.7 or not can_raise):
+                self.add_action(round_, player_id, "Check", state)
+            else:
+                if level == 0:
+                    pot = sum(state["invested"])
+                    new_level = (pot * Decimal(rng.uniform(0.33, 1))).quantize(CENT)
+                else:
+                    new_level = level * rng.choice((2, 3, 4))
+                new_level = min(cap, max(new_level, level + state["bb"]))
+                self.add_action(round_, player_id, "Bet" if level == 0 else "Raise", state, bets, new_level - bets[player_id])
+                level = new_level
+                raises += 1
+                need_to_act = [other for other in acting_order if other in live and other != player_id]
+
+    def ohh(self) -> dict:
+        """Returns the next hand as an OHH object, as it is read back from an OHH file."""
+        return json.loads(json.dumps(self.hand().to_json(self.session), default = str))
+
+
+def generate_hands(number_hands, **options):
+    """Yields number_hands OHH objects, options are the HandGenerator arguments.
+    The hands are not kept in memory, so any number of hands can be generated."""
+    generator = HandGenerator(**options)
+    for _ in range(number_hands):
+        hand = generator.ohh()
+        generator.session.hands.clear()
+        yield hand
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir")
+    parser.add_argument("--hands", type = int, default = 1000)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--table-sizes", type = int, nargs = "+", default = [6])
+    parser.add_argument("--pool-size", type = int, default = 100)
+    args = parser.parse_args()
+
+    generator = HandGenerator(seed = args.seed, table_sizes = args.table_sizes, pool_size = args.pool_size)
+    for _ in range(args.hands):
+        generator.hand()
+    generator.session.save_to_OHH(args.output_dir)
+    print(f"{args.hands} hands saved in {args.output_dir}/session_{generator.session.session_id}.OHH")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,42 @@
 from models import * 
-import pandas as pd
+import hashlib
+import time
 from io import BytesIO
-from matplotlib.figure import Figure
-import numpy as np
-import seaborn as sns
 from utils.cards_utils import cardsToClass
+from utils.lru_cache import LRUCache, register_database_cache
+# matplotlib, seaborn and numpy are imported by the functions drawing the plots, so the application starts without loading them
 
 
-def generate_cummulative_profit_plot(player_name, db_path, window_size = 10):
-    player_profits = get_player_profit_historique(player_name, db_path)
-    profits_df =  pd.DataFrame(player_profits)
-    profits_df["date_time"] =  pd.to_datetime(profits_df['date_time'], format='%Y-%m-%d %H:%M:%S')
-    profits_df.sort_values(by='date_time', inplace=True, ignore_index=True)
-    profits_df["profit_cum"] = np.cumsum(profits_df["profit"])
-    profits_df["profit_cum_smooth"] = profits_df["profit_cum"].rolling(window=window_size).mean()
-    
+# PNG images of the plots, bounded by their total size. A plot is keyed by (database, data version, player, plot type,
+# parameters), so the plots of a database are regenerated only once its data changes (see models.data_version).
+plot_cache = register_database_cache(LRUCache(Config.PLOT_CACHE_MAX_BYTES, size = lambda plot: len(plot["png"])))
+
+def get_plot(db_path, plot_type, player_name, generate, **parameters):
+    """Returns the cache entry of a plot (see plot_cache), calling generate(player_name, db_path, **parameters) to get
+    its image (a BytesIO) if it is not cached for the current data of the database.
+    The entry is a dictionary with the image (png), its ETag (hash of the image) and the time it was generated
+    (last_modified), so browsers can revalidate it and get a 304."""
+    with get_db_connection(db_path) as conn:
+        version = data_version(conn.cursor())
+    key = (db_path, version, player_name, plot_type, tuple(sorted(parameters.items())))
+    plot = plot_cache.get(key)
+    if plot is None:
+        png = generate(player_name, db_path, **parameters).getvalue()
+        plot = plot_cache.add(key, {"png": png, "etag": hashlib.sha1(png).hexdigest(), "last_modified": time.time()})
+    return plot
+
+
+def generate_cummulative_profit_plot(player_name, db_path, window_size = 10, date_from = None, date_to = None):
+    from matplotlib.figure import Figure
+
     # Generate the plot
     fig = Figure(figsize=(12, 6))
     ax = fig.subplots()
-    #ax.plot(profits_df["profit_cum"])
-    ax.plot(profits_df["profit_cum_smooth"])
+
+    # The curve is downsampled by SQLite to the width of the axes in pixels, whatever the number of hands
+    width = int(fig.get_figwidth() * fig.dpi * ax.get_position().width)
+    player_profits = get_player_profit_historique(player_name, db_path, width, window_size, date_from, date_to)
+    ax.plot([row["hand_number"] for row in player_profits], [row["profit_cum_smooth"] for row in player_profits])
     ax.set_title(f"Statistics for {player_name}")
     ax.set_xlabel("Hands")
     ax.set_ylabel("Cumulative profit (€)")
@@ -32,28 +49,9 @@ def generate_cummulative_profit_plot(player_name, db_path, window_size = 10):
 
 
 # Returns a dictionnary of the type hand_class : probability
-def get_hand_class_stats(player_name, db_path, position = None):
-    hands = []
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM players WHERE name == ?", (player_name,))
-        player_id = cursor.fetchone()[0]
-        
-        data = pd.read_sql(f"SELECT hand_class, position, vpip, pfr, limp, two_bet, h.number_players FROM players_hands JOIN hands h ON h.id == hand_id WHERE player_id == {player_id} AND hand_class IS NOT NULL ",conn)    
-
-        if position :
-            data = data[data["position"] == position]
-
-        # Calculating the required metrics
-        result = data.groupby("hand_class").agg(
-            hand_class_count=("hand_class", "size"),  # Count the occurrences of each hand_class
-            vpip_count=("vpip", "sum"),  # Sum vpip for each hand_class
-            two_bet_count=("two_bet", "sum"),
-            limp_count=("limp", "sum")
-        ).reset_index()
-        result["pourcentage_vpip"] = result["vpip_count"] / result["hand_class_count"]
-
-        return dict(zip(result['hand_class'], result['pourcentage_vpip']))
+def get_hand_class_stats(player_name, db_path, position = None, buckets = None):
+    hand_classes = get_player_hand_classes(db_path, player_name, position, buckets)
+    return {hand_class: counters["vpip"] / counters["dealt"] for hand_class, counters in hand_classes.items()}
 
 hand_structure = [
     ['AA', 'AKs', 'AQs', 'AJs', 'ATs', 'A9s', 'A8s', 'A7s', 'A6s', 'A5s', 'A4s', 'A3s', 'A2s'],
@@ -71,9 +69,33 @@ hand_structure = [
     ['A2o', 'K2o', 'Q2o', 'J2o', 'T2o', '92o', '82o', '72o', '62o', '52o', '42o', '32o', '22']
 ]
 
-def generate_opening_range_plot(player_name, db_path, position = None):
+def get_opening_range_matrix(player_name, db_path, position = None, buckets = None):
+    """Returns the 13x13 matrix of hand_structure. Each cell holds its hand class, its counters (see
+    models.HAND_CLASSES_COUNTERS) and its VPIP, PFR, limp and two_bet percentages (None if the hand was never dealt)."""
+    hand_classes = get_player_hand_classes(db_path, player_name, position, buckets)
+    matrix = []
+    for row in hand_structure:
+        cells = []
+        for hand in row:
+            counters = hand_classes.get(hand, dict.fromkeys(HAND_CLASSES_COUNTERS, 0))
+            cells.append({
+                "hand_class": hand,
+                "counters": counters,
+                "VPIP": ratio(counters["vpip"], counters["dealt"], 100),
+                "PFR": ratio(counters["pfr"], counters["dealt"], 100),
+                "limp": ratio(counters["limp"], counters["dealt"], 100),
+                "two_bet": ratio(counters["two_bet"], counters["dealt"], 100),
+            })
+        matrix.append(cells)
+    return matrix
+
+def generate_opening_range_plot(player_name, db_path, position = None, buckets = None):
+    import numpy as np
+    import seaborn as sns
+    from matplotlib.figure import Figure
+
     print("entered generate_opening_range_plot")
-    hand_to_proba = get_hand_class_stats(player_name, db_path, position)
+    hand_to_proba = get_hand_class_stats(player_name, db_path, position, buckets)
 
     # Create a matrix with pourcentages that follows the same 13x13 structure
     hand_matrix = np.array([[hand_to_proba.get(hand, -1) for hand in row] for row in hand_structure])
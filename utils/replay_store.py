@@ -0,0 +1,107 @@
+"""
+Server-side store of the replays of the hands, kept as timelines (see utils.hand_parser.get_replay_timeline).
+
+The session only holds the id of the replayed hand and the replayer pages carry the index of their state in their
+links, so stepping through a hand rebuilds a game state from the stored timeline and does not rewrite the session.
+The store is a cache shared by all the sessions: reopening a hand opened by any tab skips its parsing, and a replay
+evicted (or lost with a restart of the server) is built again from its hand. After an import, the most recent hands
+can be built in advance (see warm_up and Config.REPLAY_WARM_UP_HANDS), and so are the neighbours of an opened hand in
+the hands list (see prefetch and Config.REPLAY_PREFETCH_HANDS).
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from models import get_db_connection
+from utils.hand_parser import get_replay_timeline
+from utils.lru_cache import LRUCache, register_database_cache
+
+
+class ReplayStore:
+    """
+    Process-wide store of replay timelines shared by all the sessions, keyed by (database, hand id, amount_in_BB).
+    It is bounded by the size of the timelines (their length as JSON, close to their size in memory), the least
+    recently used ones are evicted first. hits and misses count the lookups served from the store or parsed.
+    """
+    def __init__(self, max_bytes = 32 * 1024 * 1024):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.replays = LRUCache(max_bytes, size = lambda timeline: len(json.dumps(timeline)))
+        self.executor = None # Thread building the prefetched timelines, started by the first prefetch
+
+    def get(self, db_path, hand_id, amount_in_BB = True):
+        """Returns the timeline of a hand, built from its OHH data if needed, or None if there is no such hand."""
+        key = (db_path, hand_id, amount_in_BB)
+        timeline = self.replays.get(key)
+        with self.lock:
+            if timeline is not None:
+                self.hits += 1
+                return timeline
+            self.misses += 1
+
+        if not os.path.exists(db_path): # Deleted database, connecting would create an empty file
+            return None
+        with get_db_connection(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ohh_data FROM hands_ohh WHERE hand_id = ?", (hand_id,))
+            result = cursor.fetchone()
+        if not result:
+            return None
+        return self.replays.add(key, get_replay_timeline(json.loads(result["ohh_data"]), amount_in_BB))
+
+    def build(self, db_path, hand_ids, amount_in_BB = True):
+        """Builds the timelines of the hands of hand_ids that are not stored yet. Returns the number of timelines built.
+        Nothing is built if the database was deleted meanwhile (e.g. before a prefetch ran), so it is not created again."""
+        stored = {hand_id for path, hand_id, in_BB in self.replays.keys() if path == db_path and in_BB == amount_in_BB}
+        hand_ids = [hand_id for hand_id in hand_ids if hand_id not in stored]
+        if not hand_ids or not os.path.exists(db_path):
+            return 0
+        with get_db_connection(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT hand_id, ohh_data FROM hands_ohh WHERE hand_id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(hand_ids),))
+            rows = cursor.fetchall()
+        for row in rows:
+            self.replays.add((db_path, row["hand_id"], amount_in_BB), get_replay_timeline(json.loads(row["ohh_data"]), amount_in_BB))
+        return len(rows)
+
+    def prefetch(self, db_path, hand_ids, amount_in_BB = True):
+        """Builds the missing timelines of hand_ids in a background thread, e.g. the neighbours of the opened hand in the hands list."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "replay-prefetch")
+        hand_ids = list(hand_ids)
+
+        def build():
+            try:
+                return self.build(db_path, hand_ids, amount_in_BB)
+            except Exception as e:
+                print("Prefetch of replays failed:", e)
+        return self.executor.submit(build)
+
+    def warm_up(self, db_path, number_hands, amount_in_BB = True):
+        """Builds the timelines of the number_hands most recent hands (the first ones of the hands list) that are not
+        stored yet, e.g. after an import. Returns the number of timelines built."""
+        if not os.path.exists(db_path):
+            return 0
+        with get_db_connection(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM hands ORDER BY date_time DESC, id DESC LIMIT ?", (number_hands,))
+            hand_ids = [row["id"] for row in cursor.fetchall()]
+        return self.build(db_path, hand_ids, amount_in_BB)
+
+    def statistics(self):
+        """Returns the counters of the store."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"timelines": len(self.replays), "size": self.replays.size, "max_size": self.replays.max_size, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+    def clear(self, db_path):
+        """Forgets the replays of a database, for example when it is deleted."""
+        self.replays.clear(db_path)
+
+
+replay_store = register_database_cache(ReplayStore(Config.REPLAY_STORE_MAX_BYTES))
@@ -0,0 +1,204 @@
+"""
+In-memory columnar copy of players_hands (joined with the hands columns used as filters), for ad-hoc statistics.
+
+The rows of a database are loaded as NumPy arrays on its first query, and the rows of the hands imported since then
+are appended before each query. Statistics are then computed with boolean masks for any combination of filters
+(player, position, number of players, stakes, date range, hand class), optionally grouped by a column.
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from models import ratio_statistics
+from utils.lru_cache import register_database_cache
+# numpy is imported by the methods using it, so the application starts without loading it (the dtypes are given by name)
+
+# Numeric columns: name -> (SQL expression, dtype)
+NUMERIC_COLUMNS = {
+    "hand_id": ("ph.hand_id", "int64"),
+    "player_id": ("ph.player_id", "int64"),
+    "number_players": ("h.number_players", "int8"),
+    "date": ("CAST(strftime('%s', h.date_time) AS INTEGER)", "int64"), # Unix timestamp
+    "participed": ("ph.participed", "int8"),
+    "vpip": ("ph.vpip", "int8"),
+    "pfr": ("ph.pfr", "int8"),
+    "aggressive": ("ph.aggressive", "int16"),
+    "passive": ("ph.passive", "int16"),
+    "two_bet_possibility": ("ph.two_bet_possibility", "int8"),
+    "two_bet": ("ph.two_bet", "int8"),
+    "limp": ("ph.limp", "int8"),
+    "three_bet_possibility": ("ph.three_bet_possibility", "int8"),
+    "three_bet": ("ph.three_bet", "int8"),
+    "profit_bb": ("CAST(ph.profit AS REAL) / h.big_blind_amount", "float64"),
+}
+# Columns with few distinct values, stored as codes of a vocabulary: name -> SQL expression
+CATEGORICAL_COLUMNS = {
+    "position": "ph.position_name",
+    "hand_class": "ph.hand_class",
+    "big_blind": "CAST(h.big_blind_amount AS REAL)",
+}
+# Columns summed by the statistics, the hands are counted
+SUMMED_COLUMNS = ("participed", "vpip", "pfr", "aggressive", "passive", "two_bet_possibility", "two_bet", "limp",
+                  "three_bet_possibility", "three_bet", "profit_bb")
+
+# Key of the group of the rows without value when grouping by a categorical column (e.g. the hand class of the
+# opponents whose cards were not shown), so the keys of a result are all strings and can be sorted (e.g. by jsonify)
+UNKNOWN_LABEL = "unknown"
+
+LOAD_CHUNK_SIZE = 100000
+
+
+class HandsColumns:
+    """Columns of the players_hands rows of one database, up to last_hand_id."""
+    def __init__(self):
+        self.vocabularies = {name: {} for name in CATEGORICAL_COLUMNS} # value -> code, codes never change
+        self.table_root = None # Root page of players_hands, it changes when the table is rebuilt
+        self.lock = threading.Lock()
+        self.clear_rows()
+
+    def clear_rows(self):
+        import numpy as np
+        # The arrays are replaced, never modified, so a query can keep using the ones it started with
+        self.arrays = {name: np.empty(0, dtype) for name, (_, dtype) in NUMERIC_COLUMNS.items()}
+        self.arrays.update({name: np.empty(0, "int16") for name in CATEGORICAL_COLUMNS})
+        self.last_hand_id = 0
+
+    def refresh(self, db_path):
+        """Appends the rows of the hands imported since the last refresh, or reloads everything if players_hands was rebuilt."""
+        with sqlite3.connect(db_path, isolation_level = None) as conn:
+            conn.execute("BEGIN") # Single snapshot for the checks and the load
+            table_root, max_hand_id = conn.execute("""
+            SELECT (SELECT rootpage FROM sqlite_master WHERE name = 'players_hands'), (SELECT MAX(hand_id) FROM players_hands)
+            """).fetchone()
+            if table_root != self.table_root:
+                self.clear_rows()
+                self.table_root = table_root
+            if max_hand_id is not None and max_hand_id > self.last_hand_id:
+                self.append(conn, self.last_hand_id, max_hand_id)
+                self.last_hand_id = max_hand_id
+            conn.execute("COMMIT")
+
+    def append(self, conn, after_hand_id, last_hand_id):
+        import numpy as np
+        expressions = [expression for expression, _ in NUMERIC_COLUMNS.values()] + list(CATEGORICAL_COLUMNS.values())
+        cursor = conn.execute(f"""
+        SELECT {', '.join(expressions)}
+        FROM players_hands ph JOIN hands h ON h.id = ph.hand_id
+        WHERE ph.hand_id > ? AND ph.hand_id <= ?
+        ORDER BY ph.hand_id
+        """, (after_hand_id, last_hand_id))
+        chunks = {name: [array] for name, array in self.arrays.items()}
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+            if not rows:
+                break
+            values = list(zip(*rows))
+            for index, (name, (_, dtype)) in enumerate(NUMERIC_COLUMNS.items()):
+                chunks[name].append(np.array(values[index], dtype = dtype))
+            for index, name in enumerate(CATEGORICAL_COLUMNS, start = len(NUMERIC_COLUMNS)):
+                vocabulary = self.vocabularies[name]
+                codes = (vocabulary.setdefault(value, len(vocabulary)) for value in values[index])
+                chunks[name].append(np.fromiter(codes, dtype = np.int16, count = len(rows)))
+        self.arrays = {name: np.concatenate(arrays) for name, arrays in chunks.items()}
+
+    def codes(self, name, values):
+        """Returns the codes of the given values of a categorical column, unknown values are ignored."""
+        vocabulary = self.vocabularies[name]
+        return [vocabulary[value] for value in values if value in vocabulary]
+
+    def labels(self, name):
+        """Returns the array code -> value of a categorical column."""
+        import numpy as np
+        labels = np.empty(len(self.vocabularies[name]), dtype = object)
+        for value, code in self.vocabularies[name].items():
+            labels[code] = value
+        return labels
+
+
+def timestamp(date, end = False):
+    """Returns the Unix timestamp of a "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS" UTC date.
+    With end = True, a date without time is the end of that day, so date ranges include their last day."""
+    moment = datetime.fromisoformat(date).replace(tzinfo = timezone.utc)
+    if end and len(date) <= 10:
+        moment += timedelta(days = 1, seconds = -1)
+    return int(moment.timestamp())
+
+
+def columns_statistics(sums):
+    """Returns the statistics of a group of rows from the sums of SUMMED_COLUMNS and its number of hands: the number of
+    hands and the ratios of models.RATIO_STATISTICS (the amounts won, lost and raked are not among the columns)."""
+    return {"hands": int(sums["hands"]), **ratio_statistics(sums)}
+
+
+class StatsEngine:
+    """Columnar copies of the databases (see HandsColumns), loaded on their first query and shared by all requests."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.databases = {} # db_path -> HandsColumns
+
+    def columns(self, db_path):
+        """Returns the up to date arrays of a database and its HandsColumns."""
+        with self.lock:
+            columns = self.databases.get(db_path)
+            if columns is None:
+                columns = self.databases[db_path] = HandsColumns()
+        with columns.lock:
+            columns.refresh(db_path)
+            return columns.arrays, columns
+
+    def clear(self, db_path):
+        """Forgets the columns of a database, for example when it is deleted."""
+        with self.lock:
+            self.databases.pop(db_path, None)
+
+    def statistics(self, db_path, group_by = None, players = None, positions = None, min_players = None, max_players = None,
+                   stakes = None, date_from = None, date_to = None, hand_classes = None):
+        """
+        Returns the statistics (hands, VPIP, PFR, AF, two_bet, limp, three_bet, bb_per_hand) of the rows matching all the given filters.
+        :param group_by: None for a single result, else the name of a column (e.g. "position", "number_players", "player_id",
+                         "hand_class", "big_blind"), the result is then a dictionary column value -> statistics, the rows
+                         without value (e.g. unknown cards) being grouped under UNKNOWN_LABEL
+        :param players: Player names
+        :param positions: Position names (SB, BB, MP, HJ, CO, BU)
+        :param min_players, max_players: Range of the number of players of the hands
+        :param stakes: Big blind amounts
+        :param date_from, date_to: Range of dates ("YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS", UTC), both included
+        :param hand_classes: Hand classes of the player's cards (e.g. "AKs", "QQ")
+        """
+        import numpy as np
+        arrays, columns = self.columns(db_path)
+        mask = np.ones(len(arrays["hand_id"]), dtype = bool)
+        if players is not None:
+            with sqlite3.connect(db_path) as conn:
+                player_ids = [row[0] for row in conn.execute("SELECT id FROM players WHERE name IN (SELECT value FROM json_each(?))",
+                                                              (json.dumps(list(players)),))]
+            mask &= np.isin(arrays["player_id"], player_ids)
+        for name, values in (("position", positions), ("big_blind", stakes), ("hand_class", hand_classes)):
+            if values is not None:
+                if name == "big_blind":
+                    values = [float(value) for value in values]
+                mask &= np.isin(arrays[name], columns.codes(name, values))
+        if min_players is not None:
+            mask &= arrays["number_players"] >= min_players
+        if max_players is not None:
+            mask &= arrays["number_players"] <= max_players
+        if date_from is not None:
+            mask &= arrays["date"] >= timestamp(date_from)
+        if date_to is not None:
+            mask &= arrays["date"] <= timestamp(date_to, end = True)
+
+        if group_by is None:
+            sums = {name: arrays[name][mask].sum() for name in SUMMED_COLUMNS}
+            sums["hands"] = mask.sum()
+            return columns_statistics(sums)
+
+        keys, groups = np.unique(arrays[group_by][mask], return_inverse = True)
+        sums = {name: np.bincount(groups, weights = arrays[name][mask], minlength = len(keys)) for name in SUMMED_COLUMNS}
+        sums["hands"] = np.bincount(groups, minlength = len(keys))
+        if group_by in CATEGORICAL_COLUMNS:
+            keys = [UNKNOWN_LABEL if label is None else label for label in columns.labels(group_by)[keys]]
+        return {key.item() if hasattr(key, "item") else key: columns_statistics({name: values[index] for name, values in sums.items()})
+                for index, key in enumerate(keys)}
+
+
+stats_engine = register_database_cache(StatsEngine())